@@ -1,9 +1,48 @@
+import os
+
 import dash
+import flask
 from pycompass import Compendium, Connect
 from dash.dependencies import Input, Output
 import dash_bootstrap_components as dbc
 import pycompass
 
+from utils.annotation import AnnotationFetcher
+from utils.backend import http_session, install_run_query, session_run_query
+from utils.compendia import CompendiaDescriptor, CompendiumPool
+from utils.compendium_summary import CompendiumSummaries
+from utils.export import iter_gzip, iter_tsv, write_npz
+from utils.export_cache import ExportCache
+from utils.heatmap import HeatmapCache
+from utils.jobs import JobQueue
+from utils.lru import LRUCache
+from utils.module_jobs import init_worker
+from utils.network import NetworkCache
+from utils.query_cache import QueryCache
+from utils.ranking import RankingCache
+from utils.session_store import SessionStore, get_session_id, init_session
+from utils.single_flight import SingleFlight
+from utils.stats import StatsCache
+from utils.table import TableCache
+from utils.upload import UploadError, UploadStore, UploadTooLarge
+from utils.warmup import ModuleWarmup
+
+CACHE_FOLDER = os.environ.get('DASHCOMPASS_CACHE_FOLDER', 'cache')
+SESSION_MEMORY_BUDGET = int(os.environ.get('DASHCOMPASS_SESSION_MEMORY_BUDGET', 512 * 1024 * 1024))
+QUERY_CACHE_MEMORY_BUDGET = int(os.environ.get('DASHCOMPASS_QUERY_CACHE_MEMORY_BUDGET', 128 * 1024 * 1024))
+COMPENDIA_TTL = int(os.environ.get('DASHCOMPASS_COMPENDIA_TTL', 6 * 3600))
+COMPENDIUM_SUMMARY_TTL = int(os.environ.get('DASHCOMPASS_COMPENDIUM_SUMMARY_TTL', 24 * 3600))
+ANNOTATION_WORKERS = int(os.environ.get('DASHCOMPASS_ANNOTATION_WORKERS', 8))
+WARMUP_WORKERS = int(os.environ.get('DASHCOMPASS_WARMUP_WORKERS', 4))
+JOB_WORKERS = int(os.environ.get('DASHCOMPASS_JOB_WORKERS', 2))
+HTTP_OPTIONS = {
+    'pool_size': int(os.environ.get('DASHCOMPASS_HTTP_POOL_SIZE', 10)),
+    'retries': int(os.environ.get('DASHCOMPASS_HTTP_RETRIES', 3)),
+    'backoff': float(os.environ.get('DASHCOMPASS_HTTP_BACKOFF', 0.5)),
+}
+EXPORT_CACHE_BUDGET = int(os.environ.get('DASHCOMPASS_EXPORT_CACHE_BUDGET', 1024 * 1024 * 1024))
+UPLOAD_MAX_BYTES = int(os.environ.get('DASHCOMPASS_UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+
 app = dash.Dash(__name__,
                 suppress_callback_exceptions=True,
                 external_stylesheets=[dbc.themes.MINTY])
@@ -11,8 +50,125 @@ server = app.server
 
 app.compass_connect = Connect('http://compass.fmach.it/graphql')
 #app.compass_connect = Connect('http://10.234.1.30:8080/graphql')
-app.compass_compendium = None
-app.compass_module = None
 
-app.compass_version = app.compass_connect.get_compass_version()
-app.pycompass_version = pycompass.__version__
\ No newline at end of file
+# GraphQL responses cached in memory and in a SQLite file shared by all workers, identical
+# queries in flight at the same time are sent only once, over a pool of keep-alive connections
+app.http_session = http_session(**HTTP_OPTIONS)
+app.query_cache = QueryCache(os.path.join(CACHE_FOLDER, 'graphql.sqlite'), memory_bytes=QUERY_CACHE_MEMORY_BUDGET)
+app.single_flight = SingleFlight()
+install_run_query(app.single_flight.wrap(app.query_cache.wrap(session_run_query(app.http_session))))
+
+# per-user compendium and module, see utils/session_store.py
+app.session_store = SessionStore(os.path.join(CACHE_FOLDER, 'sessions'), max_bytes=SESSION_MEMORY_BUDGET,
+                                 connection=app.compass_connect,
+                                 on_save=lambda state: app.warmup.start(state.module_version, state.module,
+                                                                       state.previous_module_version))
+init_session(server)
+
+# COMPASS version and available compendia, fetched on first use and cached on disk
+app.compendia = CompendiaDescriptor(app.compass_connect, os.path.join(CACHE_FOLDER, 'compendia.json'),
+                                    ttl=COMPENDIA_TTL)
+# Compendium handles shared by every callback and session
+app.compendium_pool = CompendiumPool(app.compendia)
+app.pycompass_version = pycompass.__version__
+
+# counts shown in the About tab for every compendium, warmed in the background at start
+app.compendium_summaries = CompendiumSummaries(app.compendium_pool.get,
+                                               os.path.join(CACHE_FOLDER, 'compendium_summaries.json'),
+                                               ttl=COMPENDIUM_SUMMARY_TTL)
+app.compendium_summaries.warm(lambda: [o['value'] for o in app.compendia.options()])
+
+# module creation and ranking, run in a process pool and polled by the browser
+app.job_queue = JobQueue(os.path.join(CACHE_FOLDER, 'jobs.sqlite'), max_workers=JOB_WORKERS,
+                         initializer=init_worker, initargs=(app.query_cache.filename, QUERY_CACHE_MEMORY_BUDGET, HTTP_OPTIONS))
+
+# RDF triples of samples and biological features, fetched concurrently and cached per object
+app.annotation_fetcher = AnnotationFetcher(max_workers=ANNOTATION_WORKERS)
+
+# Biological Features and Sample Sets tables, built once per module version
+app.table_cache = TableCache()
+
+# NaN-aware summary statistics of each module version (heatmap colour scale, distributions)
+app.stats_cache = StatsCache()
+
+# level-of-detail heatmaps of large modules
+app.heatmap_cache = HeatmapCache()
+
+# correlation edge index of each module, sliced by the network threshold slider
+app.network_cache = NetworkCache()
+
+# distribution figures of the Tools tab, keyed by (module version, plot type)
+app.distribution_cache = LRUCache(max_entries=128)
+
+# every tab of a new module version built in the background, tasks are registered in index.py
+app.warmup = ModuleWarmup(max_workers=WARMUP_WORKERS)
+
+# full sample set and biological feature rankings, cut locally at the clicked score
+app.ranking_cache = RankingCache()
+
+# downloadable module files, shared by identical modules and bounded in size
+app.export_cache = ExportCache(os.path.join(CACHE_FOLDER, 'exports'), max_bytes=EXPORT_CACHE_BUDGET)
+
+# module files uploaded in chunks by assets/upload.js
+app.upload_store = UploadStore(os.path.join(CACHE_FOLDER, 'uploads'), max_bytes=UPLOAD_MAX_BYTES)
+
+
+@server.route('/stats/cache')
+def cache_stats():
+    return flask.jsonify(query=app.query_cache.stats(), single_flight=app.single_flight.stats(),
+                         compendium_pool=app.compendium_pool.stats())
+
+
+@server.route('/download/module-<version>.<any(tsv, "tsv.gz", npz):extension>')
+def download_module(version, extension):
+    '''
+    The session module as TSV, streamed a few rows at a time and optionally gzipped, or as npz
+    '''
+    state = app.session_store.get()
+    if state.module is None or state.module_version != version:
+        flask.abort(404)
+    filename = 'module-{version}.{extension}'.format(version=version, extension=extension)
+    if extension == 'npz':
+        path = app.export_cache.path(state.module, extension, lambda fo: write_npz(state.module, fo))
+        return flask.send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                               attachment_filename=filename)
+    chunks = iter_tsv(state.module)
+    mimetype = 'text/tab-separated-values'
+    if extension == 'tsv.gz':
+        chunks = iter_gzip(chunks)
+        mimetype = 'application/gzip'
+    chunks = app.export_cache.stream(state.module, extension, chunks)
+    return flask.Response(flask.stream_with_context(chunks), mimetype=mimetype,
+                          headers={'Content-Disposition': 'attachment; filename=' + filename})
+
+
+@server.route('/upload/module/<upload_id>', methods=['POST'])
+def upload_module_chunk(upload_id):
+    session_id = get_session_id()
+    offset = flask.request.args.get('offset', 0, type=int)
+    if offset < 0 or offset + (flask.request.content_length or 0) > app.upload_store.max_bytes:
+        return flask.jsonify(error='The file is larger than {mb} MB'.format(mb=UPLOAD_MAX_BYTES // (1024 * 1024))), 413
+    try:
+        size = app.upload_store.append(session_id, upload_id, offset, flask.request.stream)
+    except UploadTooLarge as e:
+        return flask.jsonify(error=str(e)), 413
+    except UploadError as e:
+        return flask.jsonify(error=str(e), size=app.upload_store.size(session_id, upload_id)), 409
+    return flask.jsonify(size=size)
+
+
+@server.route('/upload/module/<upload_id>/finish', methods=['POST'])
+def upload_module_finish(upload_id):
+    filename = flask.request.args.get('filename', '')
+    state = app.session_store.get()
+    # parsed before locking the session, TSV files need queries to COMPASS
+    try:
+        module = app.upload_store.finish(state.session_id, upload_id, filename, state.compendium)
+    except UploadError as e:
+        return flask.jsonify(error=str(e)), 400
+    with app.session_store.edit() as state:
+        state.set_module(module)
+        bf = len(state.module.biological_features)
+        ss = len(state.module.sample_sets)
+    return flask.jsonify(message="The size is {bf} biological features and {ss} sample sets. "
+                                 "Check the other Tabs!".format(bf=bf, ss=ss))
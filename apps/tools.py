@@ -1,6 +1,7 @@
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+import dash_dangerously_set_inner_html
 
 from pycompass import Compendium, Connect
 from dash.dependencies import Input, Output, State
@@ -26,7 +27,9 @@ edit_module_bf_layout =  html.Div([
                         dcc.Textarea(
                             id='tool-textarea-biologicalfeatures',
                             style={'width': '100%', 'height': 300}
-                        )
+                        ),
+                        dcc.Store(id='tool-textarea-biologicalfeatures-job'),
+                        dcc.Interval(id='tool-textarea-biologicalfeatures-interval', interval=1000, disabled=True)
                     ])],
                     type="default",
                 ),
@@ -77,6 +80,8 @@ edit_module_ss_layout = html.Div([
                             id='tool-textarea-samplesets',
                             style={'width': '100%', 'height': 300}
                         ),
+                        dcc.Store(id='tool-textarea-samplesets-job'),
+                        dcc.Interval(id='tool-textarea-samplesets-interval', interval=1000, disabled=True),
                     ])],
                     type="default",
                 ),
@@ -125,9 +130,9 @@ layout = html.Div([
                 dbc.CardBody([
                     dbc.Row([
                         dbc.Col(children=[
-                            html.H3('Download module TSV file'),
+                            html.H3('Download module TSV or npz file'),
                             dbc.Button(
-                                "Create TSV file",
+                                "Create module files",
                                 id="tool-download-module-button",
                                 className="mb-3",
                                 color="info",
@@ -140,34 +145,18 @@ layout = html.Div([
                                 type="default",
                             )
                         ]),
-                        #dbc.Col(children=[
-                        #    html.H3('Upload module'),
-                        #    dcc.Upload(
-                        #        id="upload-module-data",
-                        #        children=html.Div(
-                        #            ["Drag and drop or click to select a file to upload."]
-                        #        ),
-                        #        style={
-                        #            "width": "100%",
-                        #            "height": "60px",
-                        #            "lineHeight": "60px",
-                        #            "borderWidth": "1px",
-                        #            "borderStyle": "dashed",
-                        #            "borderRadius": "5px",
-                        #            "textAlign": "center",
-                        #            "margin": "10px",
-                        #        },
-                        #        multiple=True,
-                        #    ),
-                        #    html.Br(),
-                        #    dcc.Loading(
-                        #        id="upload-file-list-loading",
-                        #        children=[html.Div([
-                        #            html.Ul(id="upload-file-list")
-                        #        ])],
-                        #        type="default",
-                        #    )
-                        #]),
+                        dbc.Col(children=[
+                            html.H3('Upload module TSV or npz file'),
+                            html.P("Select a module npz or TSV file. TSV names are looked up in the selected compendium."),
+                            # a plain file input: dcc.Upload would read the whole file in the browser
+                            dash_dangerously_set_inner_html.DangerouslySetInnerHTML(
+                                '<input id="upload-module-input" type="file" accept=".npz,.tsv,.tsv.gz" '
+                                'style="width: 100%; padding: 15px; border: 1px dashed; border-radius: 5px; margin: 10px">'
+                            ),
+                            html.Br(),
+                            # filled in by assets/upload.js
+                            html.Ul(id="upload-module-status")
+                        ]),
                     ], className="p-5")
                 ], id="card-1-io"),
                 id=f"collapse-1-io",
@@ -207,7 +196,25 @@ layout = html.Div([
                                     )
                                 ]
                         ),
-                        html.Div(id='tabs-edit-module-content')
+                        html.Div(id='tabs-edit-module-content'),
+                        html.Br(),
+                        dbc.Button(
+                            f"Apply changes",
+                            id='tools-edit-apply',
+                            color="primary",
+                        ),
+                        dbc.Button(
+                            f"Discard changes",
+                            id='tools-edit-discard',
+                            style={"margin-left": "15px"}
+                        ),
+                        html.Br(),
+                        html.Br(),
+                        dcc.Loading(
+                            id="tool-edit-status-loading",
+                            children=[html.Div(id='tool-edit-status')],
+                            type="default",
+                        )
                     ])
                 ], className="p-5"),
                 id=f"collapse-2-edit",
@@ -215,8 +222,8 @@ layout = html.Div([
         ]
     ),
     dbc.Modal([
-            dbc.ModalHeader("Module modified"),
-            dbc.ModalBody("Sample Sets added to the module!"),
+            dbc.ModalHeader("Module changes queued"),
+            dbc.ModalBody(id="modal-tool-modify-module-ss-add-body"),
             dbc.ModalFooter(
                 dbc.Button("Close", id="close-modal-modify-module-ss-add", className="ml-auto")
             ),
@@ -224,8 +231,8 @@ layout = html.Div([
         id="modal-tool-modify-module-ss-add",
     ),
     dbc.Modal([
-            dbc.ModalHeader("Module modified"),
-            dbc.ModalBody("Sample Sets removed to the module!"),
+            dbc.ModalHeader("Module changes queued"),
+            dbc.ModalBody(id="modal-tool-modify-module-ss-remove-body"),
             dbc.ModalFooter(
                 dbc.Button("Close", id="close-modal-modify-module-ss-remove", className="ml-auto")
             ),
@@ -233,8 +240,8 @@ layout = html.Div([
         id="modal-tool-modify-module-ss-remove",
     ),
     dbc.Modal([
-            dbc.ModalHeader("Module modified"),
-            dbc.ModalBody("Biological Features added to the module!"),
+            dbc.ModalHeader("Module changes queued"),
+            dbc.ModalBody(id="modal-tool-modify-module-bf-add-body"),
             dbc.ModalFooter(
                 dbc.Button("Close", id="close-modal-modify-module-bf-add", className="ml-auto")
             ),
@@ -242,8 +249,8 @@ layout = html.Div([
         id="modal-tool-modify-module-bf-add",
     ),
     dbc.Modal([
-            dbc.ModalHeader("Module modified"),
-            dbc.ModalBody("Biological Features removed to the module!"),
+            dbc.ModalHeader("Module changes queued"),
+            dbc.ModalBody(id="modal-tool-modify-module-bf-remove-body"),
             dbc.ModalFooter(
                 dbc.Button("Close", id="close-modal-modify-module-bf-remove", className="ml-auto")
             ),
@@ -0,0 +1,67 @@
+// Chunked upload of module files from the Tools tab, see the /upload/module routes in app.py
+(function () {
+    var CHUNK_BYTES = 4 * 1024 * 1024;
+
+    function newUploadId() {
+        var bytes = new Uint8Array(16);
+        window.crypto.getRandomValues(bytes);
+        return Array.prototype.map.call(bytes, function (b) {
+            return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+    }
+
+    function status(lines) {
+        var el = document.getElementById('upload-module-status');
+        if (!el) {
+            return;
+        }
+        el.innerHTML = '';
+        lines.forEach(function (line) {
+            var li = document.createElement('li');
+            li.textContent = line;
+            el.appendChild(li);
+        });
+    }
+
+    function post(url, body) {
+        return fetch(url, {method: 'POST', body: body, credentials: 'same-origin'}).then(function (response) {
+            return response.json().catch(function () {
+                return {error: 'Upload failed'};
+            }).then(function (data) {
+                data.status = response.status;
+                return data;
+            });
+        });
+    }
+
+    function send(file, uploadId, offset, retries) {
+        if (offset >= file.size) {
+            return post('/upload/module/' + uploadId + '/finish?filename=' + encodeURIComponent(file.name));
+        }
+        var chunk = file.slice(offset, offset + CHUNK_BYTES);
+        return post('/upload/module/' + uploadId + '?offset=' + offset, chunk).then(function (data) {
+            if (data.status === 409 && retries > 0) {
+                // the server has a different part of the file: resume from what it has
+                return send(file, uploadId, data.size, retries - 1);
+            }
+            if (data.error) {
+                return data;
+            }
+            status(['Uploading ' + file.name + ': ' + Math.floor(100 * data.size / file.size) + '%']);
+            return send(file, uploadId, data.size, 3);
+        });
+    }
+
+    document.addEventListener('change', function (event) {
+        if (event.target.id !== 'upload-module-input' || !event.target.files.length) {
+            return;
+        }
+        var file = event.target.files[0];
+        status(['Uploading ' + file.name + ': 0%']);
+        send(file, newUploadId(), 0, 3).then(function (data) {
+            status(data.error ? [data.error] : ['File uploaded!', data.message]);
+        }, function () {
+            status(['Upload failed']);
+        });
+    });
+})();
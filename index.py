@@ -1,29 +1,20 @@
-import base64
-import os
-import uuid
-from collections import OrderedDict
-
 import dash
 import json
 import dash_core_components as dcc
-import dash_dangerously_set_inner_html
 import dash_html_components as html
 import dash_table
 from dash.dependencies import Input, Output, State
-from numpy import DataSource
+from dash.exceptions import PreventUpdate
 
 from app import app
+from utils.compendium_summary import parse_option
+from utils.heatmap import changes_view
+from utils.module_io import dump_compendium, dump_module, load_module
+from utils.module_jobs import create_module, rank
+from utils.ranking import Ranking
 from apps import overview, heatmap, network, biological_feature, sample_sets, about, tools
 
-from pycompass import Compendium, Connect, BiologicalFeature, Module, SampleSet, Plot, Annotation, Experiment, Sample, \
-    Platform, Ontology
-
-import pandas as pd
-import numpy as np
-
-N_CLICKS = OrderedDict([('overview-textarea-search-exp',0), ('overview-textarea-biofeatures-search',0),
-                        ('overview-textarea-search-sparql', 0)])
-
+from pycompass import Plot
 
 server = app.server
 
@@ -89,38 +80,6 @@ app.layout = html.Div([
     html.Div(id='tabs-content-classes')
 ])
 
-table_filter_operators = [['ge ', '>='],
-             ['le ', '<='],
-             ['lt ', '<'],
-             ['gt ', '>'],
-             ['ne ', '!='],
-             ['eq ', '='],
-             ['contains '],
-             ['datestartswith ']]
-
-def split_filter_part(filter_part):
-    for operator_type in table_filter_operators:
-        for operator in operator_type:
-            if operator in filter_part:
-                name_part, value_part = filter_part.split(operator, 1)
-                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
-
-                value_part = value_part.strip()
-                v0 = value_part[0]
-                if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
-                    value = value_part[1: -1].replace('\\' + v0, v0)
-                else:
-                    try:
-                        value = float(value_part)
-                    except ValueError:
-                        value = value_part
-
-                # word operators need spaces after them in the filter string,
-                # but we don't want these later
-                return name, operator_type[0].strip(), value
-
-    return [None] * 3
-
 ###
 # CALLBACK
 @app.callback(Output('tabs-edit-module-content', 'children'),
@@ -135,8 +94,9 @@ def render_content(tab):
 @app.callback(Output('tabs-content-classes', 'children'),
               [Input('tabs-with-classes', 'value')])
 def render_content(tab):
+    app.warmup.visit(tab)
     if tab == 'overview':
-        return overview.layout
+        return overview.layout()
     elif tab == 'heatmap':
         return heatmap.layout
     elif tab == 'network':
@@ -148,22 +108,30 @@ def render_content(tab):
     elif tab == 'tools':
         return tools.layout
     elif tab == 'about':
-        return about.layout
+        return about.layout()
 
 @app.callback(
     [Output('network-slider-output-container', 'children'), Output('network-json', 'figure')],
     [Input('network-correlation-slider', 'value')])
 def update_network_output(value):
-    if app.compass_module:
-        return 'Pearson correlation threshold: {}'.format(value), json.loads(Plot(app.compass_module).plot_network(output_format='json', threshold=value))
+    state = app.session_store.get()
+    if state.module:
+        network = app.network_cache.get(state.module_version, state.module)
+        label = 'Pearson correlation threshold: {}'.format(value)
+        edges = network.edge_index
+        if edges.truncated(value):
+            label += ' (only the {n} strongest correlations, |r| >= {r:.2f}, are shown)'.format(n=len(edges),
+                                                                                           r=edges.weakest)
+        return label, network.figure(value)
     return '', None
 
 @app.callback(
     Output('bf-annotation-network-json', 'figure'),
     [Input('bf-annotation-network-json', 'value')])
 def update_annotation_network_bf(value):
-    if app.compass_module:
-        return json.loads(Plot(app.compass_module).plot_network(output_format='json', threshold=0.5))
+    state = app.session_store.get()
+    if state.module:
+        return json.loads(Plot(state.module).plot_network(output_format='json', threshold=0.5))
     return '', None
 
 
@@ -177,76 +145,87 @@ def toggle_collapse(n, is_open):
         return not is_open
     return is_open
 
+MODULE_READY = 'Module ready! The size is {bf} biological features and {ss} sample sets. Check the other Tabs!'
+
+
 @app.callback(
     [Output("overview-textarea-biofeatures-search-confirm", "is_open"), Output("overview-textarea-biofeatures-search-confirm", "children"),
      Output("heatmap-tab", "disabled"), Output("network-tab", "disabled"), Output("sample_sets-tab", "disabled"),
-     Output("biological_features-tab", "disabled"), Output("tools-tab", "disabled")],
+     Output("biological_features-tab", "disabled"), Output("tools-tab", "disabled"),
+     Output("overview-module-job-interval", "disabled")],
     [Input('overview-textarea-biofeatures-search', 'n_clicks'), Input('overview-textarea-search-exp', 'n_clicks'),
-     Input('overview-textarea-search-sparql', 'n_clicks')],
+     Input('overview-textarea-search-sparql', 'n_clicks'), Input('overview-module-job-interval', 'n_intervals')],
     [State('overview-textarea-biofeatures', 'value'), State('overview-textarea-experiment', 'value'),
      State('overview-textarea-sparql', 'value'), State('overview-dropdown-sparql-target', 'value')]
 )
-def biofeatures_quick_search(n_clicks1, n_clicks2, n_clicks3, value1, value2, value3, value4):
-    global N_CLICKS
-    _n_clicks1 = n_clicks1 - N_CLICKS['overview-textarea-biofeatures-search']
-    _n_clicks2 = n_clicks2 - N_CLICKS['overview-textarea-search-exp']
-    _n_clicks3 = n_clicks3 - N_CLICKS['overview-textarea-search-sparql']
-    N_CLICKS['overview-textarea-biofeatures-search'] = n_clicks1
-    N_CLICKS['overview-textarea-search-exp'] = n_clicks2
-    N_CLICKS['overview-textarea-search-sparql'] = n_clicks3
-    if not app.compass_compendium:
-        return False, '', True, True, True, True, True
-    elif _n_clicks1 == 0 and _n_clicks2 == 0 and  _n_clicks3 == 0 and not app.compass_module:
-        return False, '', True, True, True, True, True
-    elif _n_clicks1 == 0 and _n_clicks2 == 0 and  _n_clicks3 == 0 and app.compass_module:
-        return True, 'Module ready! The size is {bf} biological features and {ss} sample sets. Check the other Tabs!'.format(
-            bf=len(app.compass_module.biological_features),
-            ss=len(app.compass_module.sample_sets),
-        ), False, False, False, False, False
+def biofeatures_quick_search(n_clicks1, n_clicks2, n_clicks3, n_intervals, value1, value2, value3, value4):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if triggered == ['overview-module-job-interval.n_intervals']:
+        return _poll_module_job()
+    with app.session_store.edit() as state:
+        return _biofeatures_quick_search(state, n_clicks1, n_clicks2, n_clicks3, value1, value2, value3, value4)
+
+
+def _module_ready(state):
+    return True, MODULE_READY.format(
+        bf=len(state.module.biological_features),
+        ss=len(state.module.sample_sets),
+    ), False, False, False, False, False, True
+
+
+def _no_module():
+    return False, '', True, True, True, True, True, True
+
+
+def _poll_module_job():
+    state = app.session_store.get()
+    job = app.job_queue.get(state.module_job, state.session_id)
+    if job is None:
+        return _module_ready(state) if state.module else _no_module()
+    disabled = not state.module
+    if job['status'] in ('queued', 'running'):
+        message = '{message} ... {progress:.0f}%'.format(message=job['message'], progress=100 * job['progress'])
+        return True, message, disabled, disabled, disabled, disabled, disabled, False
+    with app.session_store.edit() as state:
+        if state.module_job != job['id']:
+            raise PreventUpdate
+        state.module_job = None
+        if job['status'] == 'failed':
+            return True, 'Module creation failed: ' + job['message'], disabled, disabled, disabled, disabled, disabled, True
+        state.set_module(load_module(app.job_queue.result(job['id']), app.compass_connect))
+        return _module_ready(state)
+
+
+def _submit_module_job(state, search, value, target=None):
+    state.module_job = app.job_queue.submit(state.session_id, 'create_module', create_module,
+                                            dump_compendium(state.compendium), search, value, target)
+    disabled = not state.module
+    return True, 'Waiting for a free worker ...', disabled, disabled, disabled, disabled, disabled, False
+
+
+def _biofeatures_quick_search(state, n_clicks1, n_clicks2, n_clicks3, value1, value2, value3, value4):
+    _n_clicks1 = n_clicks1 - state.n_clicks.get('overview-textarea-biofeatures-search', 0)
+    _n_clicks2 = n_clicks2 - state.n_clicks.get('overview-textarea-search-exp', 0)
+    _n_clicks3 = n_clicks3 - state.n_clicks.get('overview-textarea-search-sparql', 0)
+    state.n_clicks['overview-textarea-biofeatures-search'] = n_clicks1
+    state.n_clicks['overview-textarea-search-exp'] = n_clicks2
+    state.n_clicks['overview-textarea-search-sparql'] = n_clicks3
+    if not state.compendium:
+        return _no_module()
+    elif _n_clicks1 == 0 and _n_clicks2 == 0 and  _n_clicks3 == 0 and state.module_job:
+        return _poll_module_job()
+    elif _n_clicks1 == 0 and _n_clicks2 == 0 and  _n_clicks3 == 0 and not state.module:
+        return _no_module()
+    elif _n_clicks1 == 0 and _n_clicks2 == 0 and  _n_clicks3 == 0 and state.module:
+        return _module_ready(state)
     elif _n_clicks1 == 1 and _n_clicks2 == 0 and _n_clicks3 == 0:
-        names = [x.strip() for x in value1.split(',')]
-        bf = BiologicalFeature.using(app.compass_compendium).get(filter={'name_In': names})
-        bf_ids = [b.id for b in bf]
-        alias = []
-        for n in names:
-            alias.append("{{?s <http://purl.obolibrary.org/obo/NCIT_C41095> '{n}'}}".format(n=n))
-        sparql = 'SELECT ?s ?p ?o WHERE {{ {alias} }}'.format(alias=' UNION '.join(alias))
-        for _bf in BiologicalFeature.using(app.compass_compendium).by(sparql=sparql):
-            if _bf.id not in bf_ids:
-                bf.append(_bf)
-        app.compass_module = Module.using(app.compass_compendium).create(biofeatures=bf)
-        return True, 'Module ready! The size is {bf} biological features and {ss} sample sets. Check the other Tabs!'.format(
-            bf=len(app.compass_module.biological_features),
-            ss=len(app.compass_module.sample_sets),
-        ), False, False, False, False, False
+        return _submit_module_job(state, 'biofeatures', value1)
     elif _n_clicks1 == 0 and _n_clicks2 == 1 and _n_clicks3 == 0:
-        exp_id = [x.strip() for x in value2.split(',')]
-        e = Experiment.using(app.compass_compendium).get(filter={'experimentAccessId_In': exp_id})
-        ss = SampleSet.using(app.compass_compendium).get(filter={"experiments": [x.id for x in e]})
-        app.compass_module = Module.using(app.compass_compendium).create(samplesets=ss)
-        return True, 'Module ready! The size is {bf} biological features and {ss} sample sets. Check the other Tabs!'.format(
-            bf=len(app.compass_module.biological_features),
-            ss=len(app.compass_module.sample_sets),
-        ), False, False, False, False, False
+        return _submit_module_job(state, 'experiments', value2)
     elif _n_clicks1 == 0 and _n_clicks2 == 0 and _n_clicks3 == 1:
-        sparql = []
-        for x in value3.strip().split('\n'):
-            if x.strip().startswith('#'):
-                continue
-            sparql.append(x)
-        if value4 == 'sample':
-            s = Sample.using(app.compass_compendium).by(sparql=' '.join(sparql))
-            ss = SampleSet.using(app.compass_compendium).by(samples=s)
-            app.compass_module = Module.using(app.compass_compendium).create(samplesets=ss)
-        else:
-            bf = BiologicalFeature.using(app.compass_compendium).by(sparql=' '.join(sparql))
-            app.compass_module = Module.using(app.compass_compendium).create(biofeatures=bf)
-        return True, 'Module ready! The size is {bf} biological features and {ss} sample sets. Check the other Tabs!'.format(
-            bf=len(app.compass_module.biological_features),
-            ss=len(app.compass_module.sample_sets),
-        ), False, False, False, False, False
+        return _submit_module_job(state, 'sparql', value3, value4)
     else:
-        return False, '', True, True, True, True, True
+        return _no_module()
 
 
 @app.callback(
@@ -255,13 +234,20 @@ def biofeatures_quick_search(n_clicks1, n_clicks2, n_clicks3, value1, value2, va
     [State("heatmap-json", "children")],
 )
 def toggle_annotation(data, is_open):
-    if data and app.compass_module:
-        bf = next((x for x in app.compass_module.biological_features if x.id == data['points'][0]['y']), None)
-        ss = next((x for x in app.compass_module.sample_sets if x.id == data['points'][0]['x']), None)
+    state = app.session_store.get()
+    module = state.module
+    if data and module:
+        bf_id, ss_id = data['points'][0]['y'], data['points'][0]['x']
+        if app.heatmap_cache.use_lod(module):
+            bf_id, ss_id = app.heatmap_cache.get(state.module_version, module).ids_at(ss_id, bf_id)
+        bf = next((x for x in module.biological_features if x.id == bf_id), None)
+        ss = next((x for x in module.sample_sets if x.id == ss_id), None)
         ss_anno = []
         bf_anno = []
-        for s in ss:
-            for t in Annotation(s).get_triples():
+        samples = app.annotation_fetcher.samples(ss) if ss else []
+        bf_triples = app.annotation_fetcher.submit([bf] if bf else [])
+        for s, triples in zip(samples, app.annotation_fetcher.submit(samples)):
+            for t in triples.result():
                 geo = 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc='
                 sra = 'https://www.ncbi.nlm.nih.gov/sra/?term='
                 if s.sampleName.startswith('GSM'):
@@ -269,8 +255,9 @@ def toggle_annotation(data, is_open):
                 else:
                     url = sra + s.sampleName.split('.')[0]
                 ss_anno.append({'sample': '[' + s.sampleName + '](' + url + ')', 'subject': t[0], 'predicate': t[1], 'object': t[2]})
-        for t in Annotation(bf).get_triples():
-            bf_anno.append({'subject': t[0], 'predicate': t[1], 'object': t[2]})
+        for triples in bf_triples:
+            for t in triples.result():
+                bf_anno.append({'subject': t[0], 'predicate': t[1], 'object': t[2]})
 
         return bf_anno, ss_anno
     return [], []
@@ -292,8 +279,8 @@ def toggle_modal_create_quick_module(n1, n2, is_open):
 def select_compendium(value):
     if not value:
         return
-    compendium, version, db, normalization = value.split('__')[1:-1]
-    app.compass_compendium = app.compass_connect.get_compendium(compendium, version, db, normalization)
+    with app.session_store.edit() as state:
+        state.compendium = app.compendium_pool.get(*parse_option(value))
 
 @app.callback(
     dash.dependencies.Output('overview-textarea-sparql', 'value'),
@@ -322,11 +309,12 @@ def select_sparql_target(value):
     Output('biofeature-container', 'children'),
     [Input('biofeature-dummy', "children")])
 def update_table_biological_features(page_current):
-    if not app.compass_module:
+    module = app.session_store.get().module
+    if not module:
         return None
-    if len(app.compass_module.biological_features) == 0:
+    if len(module.biological_features) == 0:
         return None
-    columns = [{'name': x, 'id': x} for x in app.compass_module.biological_features[0].__dict__.keys() if x in ('id', 'name', 'description')]
+    columns = [{'name': x, 'id': x} for x in module.biological_features[0].__dict__.keys() if x in ('id', 'name', 'description')]
     return dash_table.DataTable(
         id='biofeature-table',
         page_current=0,
@@ -351,50 +339,24 @@ def update_table_biological_features(page_current):
      Input('biofeature-table', 'sort_by'),
      Input('biofeature-table', 'filter_query')])
 def update_table_biological_features(page_current, page_size, sort_by, filter):
-    if not app.compass_module:
+    state = app.session_store.get()
+    if not state.module:
         return None
-    if len(app.compass_module.biological_features) == 0:
+    if len(state.module.biological_features) == 0:
         return None
-    columns = [{'name': x, 'id': x} for x in app.compass_module.biological_features[0].__dict__.keys() if x in ('id', 'name', 'description')]
-    data = pd.DataFrame([x.__dict__ for x in app.compass_module.biological_features], columns=[x['name'] for x in columns])
-    filtering_expressions = filter.split(' && ')
-    dff = data
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = split_filter_part(filter_part)
-
-        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
-            # these operators match pandas series operator method names
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-        elif operator == 'contains':
-            dff = dff.loc[dff[col_name].str.contains(filter_value)]
-        elif operator == 'datestartswith':
-            # this is a simplification of the front-end filtering logic,
-            # only works with complete fields in standard format
-            dff = dff.loc[dff[col_name].str.startswith(filter_value)]
-
-    if len(sort_by):
-        dff = dff.sort_values(
-            [col['column_id'] for col in sort_by],
-            ascending=[
-                col['direction'] == 'asc'
-                for col in sort_by
-            ],
-            inplace=False
-        )
-
-    page = page_current
-    size = page_size
-    return dff.iloc[page * size: (page + 1) * size].to_dict('records')
+    table = app.table_cache.get(state.module_version, 'biological_features', state.module)
+    return table.page(page_current, page_size, sort_by, filter)
 
 @app.callback(
     Output('sample-sets-container', 'children'),
     [Input('sample-sets-dummy', "children")])
 def update_table_sample_sets(page_current):
-    if not app.compass_module:
+    module = app.session_store.get().module
+    if not module:
         return None
-    if len(app.compass_module.sample_sets) == 0:
+    if len(module.sample_sets) == 0:
         return None
-    columns = [{'name': x, 'id': x} for x in app.compass_module.sample_sets[0].__dict__.keys() if x in ('id', 'name')]
+    columns = [{'name': x, 'id': x} for x in module.sample_sets[0].__dict__.keys() if x in ('id', 'name')]
     return dash_table.DataTable(
         id='sample-sets-table',
         page_current=0,
@@ -419,136 +381,86 @@ def update_table_sample_sets(page_current):
      Input('sample-sets-table', 'sort_by'),
      Input('sample-sets-table', 'filter_query')])
 def update_table_sample_sets(page_current, page_size, sort_by, filter):
-    if not app.compass_module:
+    state = app.session_store.get()
+    if not state.module:
         return None
-    if len(app.compass_module.biological_features) == 0:
+    if len(state.module.biological_features) == 0:
         return None
-    columns = [{'name': x, 'id': x} for x in app.compass_module.sample_sets[0].__dict__.keys() if x in ('id', 'name')]
-    data = pd.DataFrame([x.__dict__ for x in app.compass_module.sample_sets], columns=[x['name'] for x in columns])
-    filtering_expressions = filter.split(' && ')
-    dff = data
-    for filter_part in filtering_expressions:
-        col_name, operator, filter_value = split_filter_part(filter_part)
-
-        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
-            # these operators match pandas series operator method names
-            dff = dff.loc[getattr(dff[col_name], operator)(filter_value)]
-        elif operator == 'contains':
-            dff = dff.loc[dff[col_name].str.contains(filter_value)]
-        elif operator == 'datestartswith':
-            # this is a simplification of the front-end filtering logic,
-            # only works with complete fields in standard format
-            dff = dff.loc[dff[col_name].str.startswith(filter_value)]
-
-    if len(sort_by):
-        dff = dff.sort_values(
-            [col['column_id'] for col in sort_by],
-            ascending=[
-                col['direction'] == 'asc'
-                for col in sort_by
-            ],
-            inplace=False
-        )
+    table = app.table_cache.get(state.module_version, 'sample_sets', state.module)
+    return table.page(page_current, page_size, sort_by, filter)
 
-    page = page_current
-    size = page_size
-    return dff.iloc[page * size: (page + 1) * size].to_dict('records')
+def _heatmap_figure(module_version, module, relayout=None, previous_module_version=None):
+    def plot_heatmap(min, max):
+        plot, sorted_bf, sorted_ss = Plot(module).plot_heatmap(output_format='json', min=min, max=max)
+        js = json.loads(plot)
+        js['layout']['plot_bgcolor'] = "rgba(100,100,100,100)" # add gray background to missing values
+        return js
+
+    def get_stats():
+        return app.stats_cache.get(module_version, module, previous_module_version)
+
+    return app.heatmap_cache.figure(module_version, module, get_stats, relayout, plot_heatmap)
 
 @app.callback(
     [Output('heatmap-json', 'figure'), Output('heatmap-json', 'style')],
-              [Input('heatmap-json', 'value')])
-def render_heatmap(heatmap):
-    if app.compass_module:
+              [Input('heatmap-json', 'value'), Input('heatmap-json', 'relayoutData')])
+def render_heatmap(heatmap, relayout):
+    state = app.session_store.get()
+    module = state.module
+    if module:
         w = '100%'
         h = '100%'
-        min = -5
-        max = 5
-        if app.compass_compendium.normalization == 'tpm':
-            min = np.percentile(app.compass_module.values[~np.isnan(app.compass_module.values)], 1)
-            max = np.percentile(app.compass_module.values[~np.isnan(app.compass_module.values)], 95)
-        plot, sorted_bf, sorted_ss = Plot(app.compass_module).plot_heatmap(output_format='json', min=min, max=max)
-        js = json.loads(plot)
-        js['layout']['plot_bgcolor'] = "rgba(100,100,100,100)" # add gray background to missing values
-        return js, {"height" : h, "width" : w}
-    return {}
+        if dash.callback_context.triggered and \
+                dash.callback_context.triggered[0]['prop_id'] == 'heatmap-json.relayoutData' and \
+                (not app.heatmap_cache.use_lod(module) or not relayout or not changes_view(relayout)):
+            raise PreventUpdate
+
+        # large modules get block means at screen resolution, full resolution when zoomed in
+        return _heatmap_figure(state.module_version, module, relayout, state.previous_module_version), {"height" : h, "width" : w}
+    return {}, {}
 
 @app.callback(
     Output(component_id='about-description', component_property='children'),
     [Input(component_id='about-dropdown', component_property='value')])
 def update_value(value):
-    if value:
-        data_source = {}
-        compendium, version, db, normalization = value.split('__')[1:-1]
-        compass_compendium = app.compass_connect.get_compendium(compendium, version, db, normalization)
-        for e in Experiment.using(compass_compendium).get():
-            ds = e.dataSource['sourceName']
-            if ds not in data_source:
-                data_source[ds] = 0
-            data_source[ds] += 1
-        bf_num = BiologicalFeature.using(compass_compendium).aggregate.total_count()
-        ss_num = SampleSet.using(compass_compendium).aggregate.total_count()
-        exp_num = sum([v for k,v in data_source.items()])
-        sample_num = Sample.using(compass_compendium).aggregate.total_count()
-        plt_num = Platform.using(compass_compendium).aggregate.total_count()
-        ontologies = [o.name for o in Ontology.using(compass_compendium).get()]
-        data_source = ["**{n}** experiments were retrieved from **{ds}**".format(n=n, ds=ds) for ds, n in data_source.items()]
+    # only compendia of the dropdown are summarized, whatever the browser sends
+    if value and value in [o['value'] for o in app.compendia.options()]:
+        compendium, version, db, normalization = parse_option(value)
+        summary = app.compendium_summaries.get(value)
+        data_source = ["**{n}** experiments were retrieved from **{ds}**".format(n=n, ds=ds) for ds, n in summary['data_sources'].items()]
         return dcc.Markdown('''
                 The **{compendium_full_name}** compendium, *{description}* (version: **{version}**, database: **{db}**) contains 
                 *{normalization}* normalized values for **{bf_num}** biological features, 
                 measured for **{ss_num}** sample sets. This corresponds to a total of **{exp_num}** experiments 
                 and **{sample_num}** samples measured on **{platform_num}** different platforms. Of these, {data_source}. 
                 For annotations, **{compendium_full_name}** relies on the following Ontologies: **{ontologies}**.
-                '''.format(compendium_full_name=compass_compendium.compendium_full_name,
-                           description=compass_compendium.description,
+                '''.format(compendium_full_name=summary['compendium_full_name'],
+                           description=summary['description'],
                            version=version,
                            db=db,
                            normalization=normalization,
-                           bf_num=bf_num,
-                           ss_num=ss_num,
-                           exp_num=exp_num,
-                           sample_num=sample_num,
-                           platform_num=plt_num,
+                           bf_num=summary['bf_num'],
+                           ss_num=summary['ss_num'],
+                           exp_num=summary['exp_num'],
+                           sample_num=summary['sample_num'],
+                           platform_num=summary['platform_num'],
                            data_source=", ".join(data_source),
-                           ontologies=", ".join(ontologies)
+                           ontologies=", ".join(summary['ontologies'])
                            )),
 
-@app.callback(
-    Output("upload-file-list", "children"),
-    [Input("upload-module-data", "filename"), Input("upload-module-data", "contents")],
-)
-def upload_file(uploaded_filenames, uploaded_file_contents):
-    upload_directory = 'static/upload/'
-    if uploaded_filenames is not None and uploaded_file_contents is not None:
-        for name, data in zip(uploaded_filenames, uploaded_file_contents):
-            data = data.encode("utf8").split(b";base64,")[1]
-            with open(os.path.join(upload_directory, name), "wb") as fp:
-                fp.write(base64.decodebytes(data))
-            app.compass_module = Module.read_from_file(os.path.join(upload_directory, name))
-            bf = len(app.compass_module.biological_features)
-            ss = len(app.compass_module.sample_sets)
-            return [html.Li("File uploaded!"), html.Li("The size is {bf} biological features and {ss} sample sets. Check the other Tabs!".format(bf=bf, ss=ss))]
-
 @app.callback(
     Output("download-file-list", "children"),
     [Input('tool-download-module-button', 'n_clicks')],
 )
 def download_module(n_clicks):
+    state = app.session_store.get()
     if n_clicks:
-        if app.compass_module:
-            _id = str(uuid.uuid4())
-            filename = 'module-' + _id + '.tsv'
-            folder = 'static/download/'
-            ss_names = [ss.name for ss in app.compass_module.sample_sets]
-            s_names = [','.join([s.sampleName for s in ss]) for ss in app.compass_module.sample_sets]
-            tuples = list(zip(ss_names, s_names))
-            columns = pd.MultiIndex.from_tuples(tuples, names=["SampleSets", "Samples"])
-            module_df = pd.DataFrame(app.compass_module.values,
-                                     columns=columns,
-                                     index=[bf.name for bf in app.compass_module.biological_features])
-            module_df.to_csv(folder + filename, sep='\t')
-            #app.compass_module.write_to_file(folder + filename)
-            location = folder + filename
-            return [html.Li(html.A(filename, href=location))]
+        if state.module:
+            links = []
+            for extension in ['tsv', 'tsv.gz', 'npz']:
+                filename = 'module-' + state.module_version + '.' + extension
+                links.append(html.Li(html.A(filename, href='/download/' + filename)))
+            return links
         else:
             return [html.Li('You need to create a module first!')]
     return ''
@@ -610,17 +522,21 @@ def toggle_accordion_tool_bf(n1, n2, is_open1, is_open2):
         return False, not is_open2
     return False, False
 
+def _distribution_figure(module_version, module, plot_type):
+    return app.distribution_cache.get_or_create(
+        (module_version, plot_type),
+        lambda: json.loads(Plot(module).plot_distribution(plot_type=plot_type, output_format='json')))
+
 @app.callback(
     Output('ss-add-graph-json', 'children'),
     [Input(f"ss-edit-dropdown", "value")],
 )
 def toggle_ss_plot_type(value):
-    if app.compass_module:
-        plot = json.loads(
-            Plot(app.compass_module).plot_distribution(plot_type=value, output_format='json'))
+    state = app.session_store.get()
+    if state.module:
         p = dcc.Graph(
             id="ss-edit-json",
-            figure=plot
+            figure=_distribution_figure(state.module_version, state.module, value)
         )
         return p
     return {}
@@ -630,8 +546,9 @@ def toggle_ss_plot_type(value):
     [Input(f"ss-add-graph-option-json", "state")],
 )
 def toggle_accordion_tool_ss(value):
-    if app.compass_module:
-        plot_type = [{'label': p, 'value': p} for p in Plot(app.compass_module).plot_types['distribution'] if p.startswith('sample_sets_')]
+    module = app.session_store.get().module
+    if module:
+        plot_type = [{'label': p, 'value': p} for p in Plot(module).plot_types['distribution'] if p.startswith('sample_sets_')]
         d = dcc.Dropdown(
             id='ss-edit-dropdown',
             options=plot_type,
@@ -640,29 +557,59 @@ def toggle_accordion_tool_ss(value):
         return d
     return ''
 
+def _rank(target, data, value, job):
+    '''
+    Names above the cutoff clicked on the distribution plot. The full ranking of each module
+    version and rank method is computed once, by a background job polled here.
+    '''
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    state = app.session_store.get()
+    if not state.module:
+        raise PreventUpdate
+    if triggered and triggered[0].endswith('.n_intervals'):
+        status = app.job_queue.get(job and job['id'], state.session_id)
+        if status is None:
+            # expired or unknown job: keep what the text area shows
+            return dash.no_update, None, True
+        if status['status'] == 'failed':
+            return 'Ranking failed: ' + status['message'], None, True
+        if status['status'] != 'done':
+            raise PreventUpdate
+        ranking = Ranking(*app.job_queue.result(job['id']))
+        app.ranking_cache.put(job['module_version'], target, job['rank_method'], ranking)
+        return ','.join(ranking.names_above(job['cutoff'])), None, True
+    if not data:
+        raise PreventUpdate
+    cutoff = data['points'][0]['x']
+    rank_method = Plot(state.module).plot_rank_name[value]
+    ranking = app.ranking_cache.get(state.module_version, target, rank_method)
+    if ranking is not None:
+        return ','.join(ranking.names_above(cutoff)), None, True
+    job_id = app.job_queue.submit(state.session_id, 'rank', rank, dump_compendium(state.compendium),
+                                  dump_module(state.module), target, rank_method)
+    job = {'id': job_id, 'module_version': state.module_version, 'rank_method': rank_method, 'cutoff': cutoff}
+    return dash.no_update, job, False
+
 @app.callback(
-    Output("tool-textarea-samplesets", "value"),
-    [Input('ss-edit-json', 'clickData'), Input('ss-edit-dropdown', 'value')],
-    [State("ss-edit-json", "children")],
+    [Output("tool-textarea-samplesets", "value"), Output("tool-textarea-samplesets-job", "data"),
+     Output("tool-textarea-samplesets-interval", "disabled")],
+    [Input('ss-edit-json', 'clickData'), Input('ss-edit-dropdown', 'value'),
+     Input("tool-textarea-samplesets-interval", "n_intervals")],
+    [State("tool-textarea-samplesets-job", "data")],
 )
-def toggle_ss_distribution(data, value, open):
-    if data:
-        cutoff = data['points'][0]['x']
-        rank_method = Plot(app.compass_module).plot_rank_name[value]
-        rank = app.compass_compendium.rank_sample_sets(app.compass_module, rank_method=rank_method, cutoff=cutoff)['ranking']['name']
-        return ','.join(rank)
+def toggle_ss_distribution(data, value, n_intervals, job):
+    return _rank('sample_sets', data, value, job)
 
 @app.callback(
     Output('bf-add-graph-json', 'children'),
     [Input(f"bf-edit-dropdown", "value")],
 )
 def toggle_bf_plot_type(value):
-    if app.compass_module:
-        plot = json.loads(
-            Plot(app.compass_module).plot_distribution(plot_type=value, output_format='json'))
+    state = app.session_store.get()
+    if state.module:
         p = dcc.Graph(
             id="bf-edit-json",
-            figure=plot
+            figure=_distribution_figure(state.module_version, state.module, value)
         )
         return p
     return {}
@@ -672,8 +619,9 @@ def toggle_bf_plot_type(value):
     [Input(f"bf-add-graph-json", "value")],
 )
 def toggle_accordion_tool_bf(value):
-    if app.compass_module:
-        plot_type = [{'label': p, 'value': p} for p in Plot(app.compass_module).plot_types['distribution'] if p.startswith('biological_features_')]
+    module = app.session_store.get().module
+    if module:
+        plot_type = [{'label': p, 'value': p} for p in Plot(module).plot_types['distribution'] if p.startswith('biological_features_')]
         d = dcc.Dropdown(
             id='bf-edit-dropdown',
             options=plot_type,
@@ -683,72 +631,118 @@ def toggle_accordion_tool_bf(value):
     return ''
 
 @app.callback(
-    Output("tool-textarea-biologicalfeatures", "value"),
-    [Input('bf-edit-json', 'clickData'), Input('bf-edit-dropdown', 'value')],
-    [State("bf-edit-json", "children")],
+    [Output("tool-textarea-biologicalfeatures", "value"), Output("tool-textarea-biologicalfeatures-job", "data"),
+     Output("tool-textarea-biologicalfeatures-interval", "disabled")],
+    [Input('bf-edit-json', 'clickData'), Input('bf-edit-dropdown', 'value'),
+     Input("tool-textarea-biologicalfeatures-interval", "n_intervals")],
+    [State("tool-textarea-biologicalfeatures-job", "data")],
 )
-def toggle_bf_distribution(data, value, open):
-    if data:
-        cutoff = data['points'][0]['x']
-        rank_method = Plot(app.compass_module).plot_rank_name[value]
-        rank = app.compass_compendium.rank_biological_features(app.compass_module, rank_method=rank_method, cutoff=cutoff)['ranking']['name']
-        return ','.join(rank)
+def toggle_bf_distribution(data, value, n_intervals, job):
+    return _rank('biological_features', data, value, job)
+
+def _edit_preview(state):
+    preview = state.module_edit.preview(state.module)
+    bf_add, bf_remove, bf_size = preview['biological_features']
+    ss_add, ss_remove, ss_size = preview['sample_sets']
+    return 'Pending changes: +{bf_add} -{bf_remove} biological features, +{ss_add} -{ss_remove} sample sets. ' \
+           'Once applied the module will have up to {bf} biological features and {ss} sample sets.'.format(
+        bf_add=bf_add, bf_remove=bf_remove, ss_add=ss_add, ss_remove=ss_remove, bf=bf_size, ss=ss_size)
+
+
+def _queue_edit(action, kind, button, is_open, value):
+    '''
+    Queue the names in the text area; nothing is sent to COMPASS until the changes are applied
+    '''
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if not triggered or triggered[0] == '.':
+        return False, ''
+    with app.session_store.edit() as state:
+        if not state.module:
+            return False, ''
+        if triggered[0] == button + '.n_clicks' and value:
+            state.module_edit.queue(action, kind, [x.strip() for x in value.split(',')])
+        return not is_open, _edit_preview(state)
 
 @app.callback(
-    Output("modal-tool-modify-module-ss-add", "is_open"),
+    [Output("modal-tool-modify-module-ss-add", "is_open"), Output("modal-tool-modify-module-ss-add-body", "children")],
     [Input('tools-ss-add', 'n_clicks'), Input('close-modal-modify-module-ss-add', 'n_clicks')],
     [State("modal-tool-modify-module-ss-add", "is_open"), State('tool-textarea-samplesets', 'value')],
 )
 def tool_add_ss(n1, n2, is_open, value):
-    if app.compass_module and value:
-        ss = SampleSet.using(app.compass_compendium).get(filter={'name_In': [x.strip() for x in value.split(',')]})
-        app.compass_module.add_sample_sets(ss)
-        if n1 or n2:
-            return not is_open
-        return is_open
-    return False
+    return _queue_edit('add', 'sample_sets', 'tools-ss-add', is_open, value)
 
 @app.callback(
-    Output("modal-tool-modify-module-bf-add", "is_open"),
+    [Output("modal-tool-modify-module-bf-add", "is_open"), Output("modal-tool-modify-module-bf-add-body", "children")],
     [Input('tools-bf-add', 'n_clicks'), Input('close-modal-modify-module-bf-add', 'n_clicks')],
     [State("modal-tool-modify-module-bf-add", "is_open"), State('tool-textarea-biologicalfeatures', 'value')],
 )
 def tool_add_bf(n1, n2, is_open, value):
-    if app.compass_module and value:
-        bf = BiologicalFeature.using(app.compass_compendium).get(filter={'name_In': [x.strip() for x in value.split(',')]})
-        app.compass_module.add_biological_features(bf)
-        if n1 or n2:
-            return not is_open
-        return is_open
-    return False
+    return _queue_edit('add', 'biological_features', 'tools-bf-add', is_open, value)
 
 @app.callback(
-    Output("modal-tool-modify-module-ss-remove", "is_open"),
+    [Output("modal-tool-modify-module-ss-remove", "is_open"), Output("modal-tool-modify-module-ss-remove-body", "children")],
     [Input('tools-ss-remove', 'n_clicks'), Input('close-modal-modify-module-ss-remove', 'n_clicks')],
     [State("modal-tool-modify-module-ss-remove", "is_open"), State('tool-textarea-samplesets', 'value')],
 )
 def tool_remove_ss(n1, n2, is_open, value):
-    if app.compass_module and value:
-        ss = SampleSet.using(app.compass_compendium).get(filter={'name_In': [x.strip() for x in value.split(',')]})
-        app.compass_module.remove_sample_sets(ss)
-        if n1 or n2:
-            return not is_open
-        return is_open
-    return False
+    return _queue_edit('remove', 'sample_sets', 'tools-ss-remove', is_open, value)
 
 @app.callback(
-    Output("modal-tool-modify-module-bf-remove", "is_open"),
+    [Output("modal-tool-modify-module-bf-remove", "is_open"), Output("modal-tool-modify-module-bf-remove-body", "children")],
     [Input('tools-bf-remove', 'n_clicks'), Input('close-modal-modify-module-bf-remove', 'n_clicks')],
     [State("modal-tool-modify-module-bf-remove", "is_open"), State('tool-textarea-biologicalfeatures', 'value')],
 )
 def tool_remove_bf(n1, n2, is_open, value):
-    if app.compass_module and value:
-        bf = BiologicalFeature.using(app.compass_compendium).get(filter={'name_In': [x.strip() for x in value.split(',')]})
-        app.compass_module.remove_biological_features(bf)
-        if n1 or n2:
-            return not is_open
-        return is_open
-    return False
+    return _queue_edit('remove', 'biological_features', 'tools-bf-remove', is_open, value)
+
+@app.callback(
+    Output("tool-edit-status", "children"),
+    [Input('tools-edit-apply', 'n_clicks'), Input('tools-edit-discard', 'n_clicks'),
+     Input("modal-tool-modify-module-ss-add", "is_open"), Input("modal-tool-modify-module-bf-add", "is_open"),
+     Input("modal-tool-modify-module-ss-remove", "is_open"), Input("modal-tool-modify-module-bf-remove", "is_open")],
+)
+def tool_edit_apply(n1, n2, *modals):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    state = app.session_store.get()
+    if not state.module:
+        return ''
+    if triggered == ['tools-edit-discard.n_clicks']:
+        with app.session_store.edit() as state:
+            state.module_edit.clear()
+        return 'Pending changes discarded.'
+    if triggered == ['tools-edit-apply.n_clicks'] and state.module_edit:
+        # COMPASS is queried before locking the session, the result is kept only if nothing
+        # changed meanwhile
+        module_version, module_edit = state.module_version, state.module_edit.dump()
+        module = state.module_edit.commit(state.module, state.compendium)
+        if module is not None:
+            # values of a module without any yet are fetched here, outside the session lock
+            module.values
+        with app.session_store.edit() as state:
+            if state.module_version != module_version or state.module_edit.dump() != module_edit:
+                return 'The module changed meanwhile, please apply the changes again.'
+            if module is None:
+                state.module_edit.clear()
+            else:
+                state.set_module(module)
+            return MODULE_READY.format(bf=len(state.module.biological_features), ss=len(state.module.sample_sets))
+    return _edit_preview(state) if state.module_edit else ''
+
+def _warm_distributions(module_version, module, previous_module_version):
+    for plot_type in Plot(module).plot_types['distribution']:
+        _distribution_figure(module_version, module, plot_type)
+
+
+# the heatmap goes through the stats cache, so that its statistics, when the colour scale
+# needs them, are derived from the previous version's
+app.warmup.register('heatmap', lambda version, module, previous: _heatmap_figure(version, module,
+                                                                                 previous_module_version=previous))
+app.warmup.register('biological_features',
+                    lambda version, module, previous: app.table_cache.get(version, 'biological_features', module))
+app.warmup.register('sample_sets',
+                    lambda version, module, previous: app.table_cache.get(version, 'sample_sets', module))
+app.warmup.register('network', lambda version, module, previous: app.network_cache.get(version, module))
+app.warmup.register('tools', _warm_distributions)
 
 if __name__ == '__main__':
     app.run_server(host='0.0.0.0', debug=True)
\ No newline at end of file
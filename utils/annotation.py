@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pycompass import Annotation, Sample
+
+
+class AnnotationFetcher:
+    '''
+    Fetch the RDF triples of many Sample or BiologicalFeature objects concurrently through a
+    bounded thread pool and keep the triples of the most recent max_entries objects
+    '''
+
+    def __init__(self, max_workers=8, max_entries=20000):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='annotation')
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(obj):
+        return obj.compendium.compendium_name, type(obj).__name__, obj.id
+
+    def _fetch(self, obj):
+        triples = Annotation(obj).get_triples()
+        with self._lock:
+            self._cache[self._key(obj)] = triples
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return triples
+
+    def submit(self, objs):
+        '''
+        Return one future per object, already resolved for the cached ones
+        '''
+        futures = []
+        for obj in objs:
+            with self._lock:
+                triples = self._cache.get(self._key(obj))
+                if triples is not None:
+                    self._cache.move_to_end(self._key(obj))
+            if triples is None:
+                futures.append(self._executor.submit(self._fetch, obj))
+            else:
+                futures.append(_Done(triples))
+        return futures
+
+    def get_triples(self, objs):
+        return [f.result() for f in self.submit(objs)]
+
+    def samples(self, sample_set):
+        '''
+        All the Sample objects of sample_set with a single query instead of one per sample
+        '''
+        ids = list(sample_set.__samples__)
+        by_id = {s.id: s for s in Sample.using(sample_set.compendium).get(filter={'id_In': ids})}
+        return [by_id[i] for i in ids if i in by_id]
+
+
+class _Done:
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
@@ -0,0 +1,56 @@
+import sys
+
+import pycompass
+import requests
+import requests.adapters
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+###
+# Every pyCOMPASS request goes through pycompass.query.run_query(url, query, headers=None), which
+# most pyCOMPASS modules import by name. Installing a replacement means rebinding it everywhere.
+
+
+def install_run_query(run_query):
+    for name, module in list(sys.modules.items()):
+        if name == 'pycompass' or name.startswith('pycompass.'):
+            if getattr(module, 'run_query', None) is not None:
+                module.run_query = run_query
+
+
+def http_session(pool_size=10, retries=3, backoff=0.5):
+    '''
+    Keep-alive session to COMPASS: up to pool_size open connections per host, responses
+    compressed with every encoding urllib3 can decode (brotli from urllib3 1.25 on, with the
+    Brotli package of requirements.txt) and retries with exponential backoff on connection
+    errors and 502, 503, 504 replies
+    '''
+    retry_args = dict(total=retries, backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+    try:
+        # GraphQL queries are read only, so POST is retried as well
+        retry = Retry(allowed_methods=None, **retry_args)
+    except TypeError:
+        retry = Retry(method_whitelist=False, **retry_args)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return session
+
+
+def session_run_query(session, timeout=None):
+    '''
+    pycompass.query.run_query sending its requests through session
+    '''
+    def run_query(url, query, headers=None):
+        request = session.post(url, json={'query': query}, headers=headers, timeout=timeout)
+        if request.status_code == 200:
+            json = request.json()
+            if 'errors' in json:
+                raise Exception(json['errors'])
+            return json
+        else:
+            raise Exception("Query failed to run by returning code of {}. {}".format(request.status_code, query))
+    return run_query
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from pycompass import Compendium
+
+logger = logging.getLogger(__name__)
+
+
+class CompendiaDescriptor:
+    '''
+    The COMPASS version and the compendia description, fetched lazily once per worker and
+    persisted to cache_file. A cached copy older than ttl is still served while a background
+    thread refreshes it, so only the very first start of a server waits for the endpoint.
+    '''
+
+    def __init__(self, connection, cache_file, ttl=6 * 3600):
+        self.connection = connection
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._data = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self):
+        return {
+            'timestamp': time.time(),
+            'compass_version': self.connection.get_compass_version(),
+            'compendia': self.connection.describe_compendia()['compendia'],
+        }
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as fi:
+                return json.load(fi)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, data):
+        folder = os.path.dirname(self.cache_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp = self.cache_file + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'w') as fo:
+            json.dump(data, fo)
+        os.replace(tmp, self.cache_file)
+
+    def _refresh(self):
+        try:
+            data = self._fetch()
+            self._write(data)
+            self._data = data
+        except Exception:
+            logger.exception('Unable to refresh the compendia description')
+        finally:
+            self._refreshing = False
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def get(self):
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    data = self._read()
+                    if data is None:
+                        data = self._fetch()
+                        self._write(data)
+                    self._data = data
+        if time.time() - self._data['timestamp'] > self.ttl:
+            self._refresh_in_background()
+        return self._data
+
+    @property
+    def compass_version(self):
+        return self.get()['compass_version']
+
+    @property
+    def compendia(self):
+        return self.get()['compendia']
+
+    def options(self, name='vespucci'):
+        '''
+        Dropdown options for every version, database and normalization of the compendium name
+        '''
+        options = []
+        for c in self.compendia:
+            if c['name'] != name:
+                continue
+            for v in c['versions']:
+                for d in v['databases']:
+                    for n in d['normalizations']:
+                        norm = n.replace('(default)', '').strip()
+                        label = "{full_name} - v {version} ({version_alias}), {database} {normalization} normalized ".format(
+                            full_name=c['fullName'],
+                            version=v['versionNumber'],
+                            version_alias=v['versionAlias'],
+                            database=d['name'],
+                            normalization=norm
+                        )
+                        value = "__{name}__{version}__{database}__{normalization}__".format(
+                            name=c['name'],
+                            version=v['versionNumber'],
+                            database=d['name'],
+                            normalization=norm
+                        )
+                        options.append({'label': label, 'value': value})
+        return options
+
+
+class CompendiumPool:
+    '''
+    Compendium handles keyed by (name, version, database, normalization), built from the
+    compendia description instead of asking COMPASS again, and shared by all callbacks and
+    sessions. The pool is emptied when the description changes.
+    '''
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self._handles = {}
+        self._compendia = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _build(self, name, version, database, normalization):
+        for c in self.descriptor.compendia:
+            if c['name'] != name:
+                continue
+            for v in c['versions']:
+                if version in (str(v['versionNumber']), str(v['versionAlias'])):
+                    return Compendium.__factory_build_object__(
+                        compendium_name=c['name'],
+                        compendium_full_name=c['fullName'],
+                        description=c['description'],
+                        version=str(v['versionNumber']),
+                        version_alias=str(v['versionAlias']),
+                        database=database,
+                        normalization=normalization,
+                        connection=self.descriptor.connection,
+                    )
+        # not described (yet): let pyCOMPASS look it up
+        return self.descriptor.connection.get_compendium(name, version, database, normalization)
+
+    def get(self, name, version, database, normalization):
+        key = (name, version, database, normalization)
+        compendia = self.descriptor.compendia
+        with self._lock:
+            if compendia is not self._compendia:
+                if self._compendia is not None and compendia != self._compendia:
+                    self._handles.clear()
+                    self.invalidations += 1
+                self._compendia = compendia
+            handle = self._handles.get(key)
+            if handle is not None:
+                self.hits += 1
+                return handle
+            self.misses += 1
+        handle = self._build(name, version, database, normalization)
+        with self._lock:
+            return self._handles.setdefault(key, handle)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'handles': len(self._handles),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,199 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from pycompass import BiologicalFeature, Experiment, Ontology, Platform, Sample, SampleSet, query
+
+logger = logging.getLogger(__name__)
+
+
+def parse_option(value):
+    '''
+    (name, version, database, normalization) of a compendium dropdown value
+    '''
+    return tuple(value.split('__')[1:-1])
+
+
+_EXPERIMENT_COUNT = '''{{
+    experiments(compendium:"{compendium}", version:"{version}", database:"{database}", normalization:"{normalization}",
+        dataSource:"{data_source}") {{
+        totalCount
+    }}
+}}'''
+
+
+def _experiment_count(compendium, data_source_id):
+    response = query.run_query(compendium.connection.url, _EXPERIMENT_COUNT.format(
+        compendium=compendium.compendium_name, version=compendium.version, database=compendium.database,
+        normalization=compendium.normalization, data_source=data_source_id))
+    return response['data']['experiments']['totalCount']
+
+
+def _data_sources(compendium):
+    '''
+    Number of experiments per data source, from one concurrent count query per data source
+    '''
+    data_sources = compendium.get_data_sources(fields=['id', 'sourceName'])
+    try:
+        # a pool of its own: waiting on the summarize executor from one of its threads could deadlock
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            counts = [(ds['sourceName'], executor.submit(_experiment_count, compendium, ds['id']))
+                      for ds in data_sources]
+            counts = [(name, f.result()) for name, f in counts]
+    except Exception:
+        # COMPASS versions that can't filter experiments by data source: list them instead
+        logger.warning('Counting the experiments of %s by listing them', compendium.compendium_name)
+        experiments = Experiment.using(compendium).get(fields=['dataSource { sourceName }'])
+        return dict(Counter(e.dataSource['sourceName'] for e in experiments))
+    return {name: n for name, n in counts if n}
+
+
+def summarize(compendium, executor):
+    '''
+    Counts shown in the About tab, with the COMPASS queries run concurrently on executor
+    '''
+    futures = {
+        'bf_num': executor.submit(BiologicalFeature.using(compendium).aggregate.total_count),
+        'ss_num': executor.submit(SampleSet.using(compendium).aggregate.total_count),
+        'sample_num': executor.submit(Sample.using(compendium).aggregate.total_count),
+        'platform_num': executor.submit(Platform.using(compendium).aggregate.total_count),
+        'ontologies': executor.submit(lambda: [o.name for o in Ontology.using(compendium).get(fields=['name'])]),
+        'data_sources': executor.submit(_data_sources, compendium),
+    }
+    summary = {k: f.result() for k, f in futures.items()}
+    summary['exp_num'] = sum(summary['data_sources'].values())
+    summary['compendium_full_name'] = compendium.compendium_full_name
+    summary['description'] = compendium.description
+    summary['timestamp'] = time.time()
+    return summary
+
+
+class CompendiumSummaries:
+    '''
+    Summaries of every compendium in the About tab dropdown, keyed by dropdown value, built
+    once and persisted to cache_file so that the page renders from memory. Summaries older than
+    ttl are still served while a background thread rebuilds them. Builds take a file lock per
+    compendium and warm() runs in a single worker, so gunicorn workers don't repeat each
+    other's queries.
+    '''
+
+    def __init__(self, get_compendium, cache_file, ttl=24 * 3600, max_workers=6):
+        self.get_compendium = get_compendium
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._summaries = None
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        folder = os.path.dirname(self.cache_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as fi:
+                return json.load(fi)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self):
+        tmp = self.cache_file + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'w') as fo:
+            json.dump(self._summaries, fo)
+        os.replace(tmp, self.cache_file)
+
+    def _loaded(self):
+        with self._lock:
+            if self._summaries is None:
+                self._summaries = self._read()
+            return self._summaries
+
+    @contextmanager
+    def _file_lock(self, name, blocking=True):
+        '''
+        Exclusive flock on cache_file.<name>.lock, across threads and workers; yields whether it
+        was taken
+        '''
+        fd = os.open('{f}.{name}.lock'.format(f=self.cache_file, name=name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def _fresh(self, summary):
+        return summary is not None and time.time() - summary['timestamp'] <= self.ttl
+
+    def _build(self, value):
+        with self._file_lock(hashlib.sha1(value.encode('utf8')).hexdigest()[:16]):
+            # built by another worker while waiting for the lock
+            summary = self._read().get(value)
+            if not self._fresh(summary):
+                summary = summarize(self.get_compendium(*parse_option(value)), self._executor)
+            return self._save(value, summary)
+
+    def _save(self, value, summary):
+        # the file lock keeps workers saving other compendia from overwriting each other
+        with self._lock, self._file_lock('file'):
+            # another worker may have saved other, or newer, summaries meanwhile
+            self._summaries = dict(self._summaries or {}, **self._read())
+            self._summaries[value] = summary
+            self._write()
+        return summary
+
+    def _refresh(self, value):
+        try:
+            self._build(value)
+        except Exception:
+            logger.exception('Unable to summarize compendium %s', value)
+        finally:
+            with self._lock:
+                self._refreshing.discard(value)
+
+    def _refresh_in_background(self, value):
+        with self._lock:
+            if value in self._refreshing:
+                return
+            self._refreshing.add(value)
+        threading.Thread(target=self._refresh, args=(value,), daemon=True).start()
+
+    def get(self, value):
+        summary = self._loaded().get(value)
+        if summary is None:
+            summary = self._read().get(value)
+            if summary is None:
+                return self._build(value)
+            with self._lock:
+                self._summaries[value] = summary
+        if not self._fresh(summary):
+            self._refresh_in_background(value)
+        return summary
+
+    def warm(self, values):
+        '''
+        Build, one after the other in a background thread, the missing or stale summaries of values
+        '''
+        def run():
+            with self._file_lock('warm', blocking=False) as locked:
+                if not locked:
+                    # another worker is warming them
+                    return
+                try:
+                    for value in values():
+                        if not self._fresh(self._loaded().get(value) or self._read().get(value)):
+                            self._refresh(value)
+                except Exception:
+                    logger.exception('Unable to warm the compendium summaries')
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,205 @@
+import csv
+import gzip
+import io
+import json
+import re
+import struct
+import zipfile
+import zlib
+
+import numpy as np
+from pycompass import BiologicalFeature, Module, Sample, SampleSet
+
+from utils.module_io import dump_module
+
+ROWS_PER_CHUNK = 256
+
+
+class InvalidModuleFile(ValueError):
+    pass
+
+
+def sample_names(module):
+    '''
+    Comma separated sample names of every sample set of the module, with a single query for all
+    the samples instead of one per sample
+    '''
+    ids = [s for ss in module.sample_sets for s in ss.__samples__]
+    names = {}
+    if ids:
+        names = {s.id: s.sampleName for s in Sample.using(module.compendium).get(filter={'id_In': ids})}
+    return [','.join([names[s] for s in ss.__samples__ if s in names]) for ss in module.sample_sets]
+
+
+def iter_tsv(module, chunk_rows=ROWS_PER_CHUNK):
+    '''
+    The module as TSV text, in the layout pandas writes for the (SampleSets, Samples) column
+    MultiIndex, generated a few rows at a time
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='\t', lineterminator='\n')
+
+    def flush():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(['SampleSets'] + [ss.name for ss in module.sample_sets])
+    yield flush()
+    writer.writerow(['Samples'] + sample_names(module))
+    yield flush()
+    values = module.values
+    names = [bf.name for bf in module.biological_features]
+    for start in range(0, len(names), chunk_rows):
+        block = values[start:start + chunk_rows].astype(object)
+        block[np.isnan(values[start:start + chunk_rows])] = None
+        for name, row in zip(names[start:start + chunk_rows], block.tolist()):
+            writer.writerow([name] + row)
+        yield flush()
+
+
+def _by_name(objects, names):
+    found = {o.name: o for o in objects}
+    return [found.get(name) for name in names]
+
+
+def read_tsv(path, compendium):
+    '''
+    Module from a TSV file written by iter_tsv (gzipped or not), parsed a block of rows at a time.
+    Names are resolved in compendium; rows and columns with unknown names are dropped.
+    '''
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as fi:
+        reader = csv.reader(fi, delimiter='\t')
+        ss_names = next(reader)[1:]
+        next(reader)
+        bf_names, blocks, block = [], [], []
+        for row in reader:
+            if not row:
+                continue
+            bf_names.append(row[0])
+            block.append([float(v) if v else np.nan for v in row[1:]])
+            if len(block) == ROWS_PER_CHUNK:
+                blocks.append(np.array(block, dtype=float))
+                block = []
+        if block:
+            blocks.append(np.array(block, dtype=float))
+    values = np.vstack(blocks) if blocks else np.zeros((0, len(ss_names)))
+    bfs = _by_name(BiologicalFeature.using(compendium).get(filter={'name_In': bf_names}), bf_names)
+    sss = _by_name(SampleSet.using(compendium).get(filter={'name_In': ss_names}), ss_names)
+    rows = [i for i, bf in enumerate(bfs) if bf is not None]
+    columns = [i for i, ss in enumerate(sss) if ss is not None]
+    module = Module()
+    module.compendium = compendium
+    module.biological_features = [bfs[i] for i in rows]
+    module.sample_sets = [sss[i] for i in columns]
+    module.__normalized_values__ = values[rows][:, columns]
+    return module
+
+
+def iter_gzip(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+###
+# Binary container: an uncompressed npz with the values as a float32 matrix (values.npy) and
+# the module description as JSON (module.npy). Members of an uncompressed zip are stored as is,
+# so the matrix can be memory-mapped straight from the file.
+
+NPZ_COMPENDIUM_FIELDS = ('compendium_name', 'version', 'database', 'normalization')
+# COMPASS ids are base64 encoded GraphQL global ids
+_id_re = re.compile(r'^[A-Za-z0-9+/=_-]{1,128}$')
+
+def write_npz(module, fileobj):
+    data = dump_module(module)
+    data.pop('__normalized_values__', None)
+    np.savez(fileobj,
+             values=np.ascontiguousarray(module.values, dtype=np.float32),
+             module=np.array(json.dumps(data)))
+
+
+def _member_offset(fileobj, info):
+    '''
+    Offset of the data of an uncompressed zip member, after its local file header
+    '''
+    fileobj.seek(info.header_offset)
+    header = fileobj.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise ValueError('Invalid zip member ' + info.filename)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def _mmap_npy(path, fileobj, info):
+    if info.compress_type != zipfile.ZIP_STORED:
+        with zipfile.ZipFile(path) as archive:
+            return np.load(archive.open(info.filename), allow_pickle=False)
+    fileobj.seek(_member_offset(fileobj, info))
+    version = np.lib.format.read_magic(fileobj)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fileobj)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fileobj)
+    return np.memmap(path, dtype=dtype, mode='r', offset=fileobj.tell(), shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def _ids(objects):
+    '''
+    Ids of the biological features or sample sets of a module description, checked before they
+    go into a query
+    '''
+    if not isinstance(objects, list):
+        raise InvalidModuleFile('Invalid module file')
+    ids = [o.get('id') if isinstance(o, dict) else None for o in objects]
+    if not all(isinstance(i, str) and _id_re.match(i) for i in ids) or len(set(ids)) != len(ids):
+        raise InvalidModuleFile('Invalid module file')
+    return ids
+
+
+def _by_id(objects, ids):
+    found = {o.id: o for o in objects}
+    return [found.get(i) for i in ids]
+
+
+def read_npz(path, compendium):
+    '''
+    Module saved by write_npz, with its values memory-mapped from path. Only the biological
+    feature and sample set ids are taken from the file, and resolved in compendium with one
+    query each; unknown ids are dropped with their rows or columns. The compendium and url
+    stored in the file are only checked, never connected to.
+    '''
+    with zipfile.ZipFile(path) as archive:
+        members = {info.filename: info for info in archive.infolist()}
+        if 'module.npy' not in members or 'values.npy' not in members:
+            raise InvalidModuleFile('Invalid module file')
+        data = json.loads(str(np.load(archive.open('module.npy'), allow_pickle=False)))
+    if not isinstance(data, dict):
+        raise InvalidModuleFile('Invalid module file')
+    stored = data.get('compendium') or {}
+    if not isinstance(stored, dict) or any(stored.get(k) != getattr(compendium, k) for k in NPZ_COMPENDIUM_FIELDS):
+        raise InvalidModuleFile('The module was saved from another compendium')
+    bf_ids = _ids(data.get('biological_features'))
+    ss_ids = _ids(data.get('sample_sets'))
+    with open(path, 'rb') as fi:
+        values = _mmap_npy(path, fi, members['values.npy'])
+    if values.dtype.kind != 'f' or values.shape != (len(bf_ids), len(ss_ids)):
+        raise InvalidModuleFile('The values don\'t match the module')
+    bfs = _by_id(BiologicalFeature.using(compendium).get(filter={'id_In': bf_ids}), bf_ids) if bf_ids else []
+    sss = _by_id(SampleSet.using(compendium).get(filter={'id_In': ss_ids}), ss_ids) if ss_ids else []
+    rows = [i for i, bf in enumerate(bfs) if bf is not None]
+    columns = [i for i, ss in enumerate(sss) if ss is not None]
+    if len(rows) < len(bf_ids) or len(columns) < len(ss_ids):
+        values = values[rows][:, columns]
+    module = Module()
+    module.compendium = compendium
+    module.biological_features = [bfs[i] for i in rows]
+    module.sample_sets = [sss[i] for i in columns]
+    module.__normalized_values__ = values
+    return module
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from utils.module_io import dump_module
+
+READ_BLOCK = 1 << 16
+
+
+def module_key(module, extension):
+    '''
+    Content hash of a module export: file format, every attribute written to the file (compendium,
+    biological features and sample sets with their ids and names) and the values themselves, so
+    that an uploaded module never shares a file with a fetched one it only has the ids of
+    '''
+    data = dump_module(module)
+    data.pop('__normalized_values__', None)
+    h = hashlib.sha256()
+    h.update(extension.encode('utf8') + b'\0')
+    h.update(json.dumps(data, sort_keys=True, default=str).encode('utf8') + b'\0')
+    values = np.ascontiguousarray(module.values, dtype=float)
+    h.update(str(values.shape).encode('utf8') + b'\0')
+    h.update(memoryview(values).cast('B'))
+    return h.hexdigest()
+
+
+class ExportCache:
+    '''
+    Exported module files in folder, named by the content hash of the module so that identical
+    modules are serialised once. The folder is kept under max_bytes by removing the least
+    recently used files; a hit refreshes the file mtime, so all workers share the same order.
+    '''
+
+    def __init__(self, folder, max_bytes=1024 * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, key, extension):
+        return os.path.join(self.folder, key + '.' + extension)
+
+    def _hit(self, path):
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _tmp(self, path):
+        return path + '.' + uuid.uuid4().hex + '.tmp'
+
+    def _commit(self, tmp, path):
+        os.replace(tmp, path)
+        self.evict()
+
+    def path(self, module, extension, write):
+        '''
+        Path of the export of module, calling write(fileobj) to create it on a miss
+        '''
+        path = self._path(module_key(module, extension), extension)
+        if self._hit(path):
+            return path
+        tmp = self._tmp(path)
+        try:
+            with open(tmp, 'wb') as fo:
+                write(fo)
+            self._commit(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return path
+
+    def stream(self, module, extension, chunks):
+        '''
+        Bytes of the export of module: read from the cached file, or taken from the chunks
+        iterator and written to the cache while they are sent. An interrupted download leaves
+        nothing behind.
+        '''
+        path = self._path(module_key(module, extension), extension)
+        if self._hit(path):
+            with open(path, 'rb') as fi:
+                for block in iter(lambda: fi.read(READ_BLOCK), b''):
+                    yield block
+            return
+        tmp = self._tmp(path)
+        try:
+            with open(tmp, 'wb') as fo:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf8')
+                    fo.write(chunk)
+                    yield chunk
+            self._commit(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.folder):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except OSError:
+                    pass
+                total -= size
@@ -0,0 +1,98 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+###
+# Compiler for the DataTable filter_query grammar: clauses of the form {column} operator value
+# joined by ' && '. A query is parsed once into a FilterPlan whose mask() evaluates every clause
+# on the whole frame and combines them into a single boolean array.
+
+OPERATORS = {
+    '>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '!=': 'ne', '=': 'eq',
+    'ge': 'ge', 'le': 'le', 'lt': 'lt', 'gt': 'gt', 'ne': 'ne', 'eq': 'eq',
+    'contains': 'contains', 'datestartswith': 'datestartswith',
+}
+
+_clause_re = re.compile(r'^\s*\{(?P<column>[^}]*)\}\s*'
+                        r'(?P<case>[is]?)(?P<operator>>=|<=|!=|=|<|>|ge|le|lt|gt|ne|eq|contains|datestartswith)'
+                        r'(?:\s+|(?<=[=<>])\s*)(?P<value>.*?)\s*$')
+
+
+def _parse_value(value_part):
+    '''
+    Return the value as text and, when it is not quoted and looks like a number, as a float
+    '''
+    if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', '`'):
+        v0 = value_part[0]
+        return value_part[1: -1].replace('\\' + v0, v0), None
+    try:
+        return value_part, float(value_part)
+    except ValueError:
+        return value_part, None
+
+
+class FilterClause:
+
+    def __init__(self, column, operator, text, number, case_insensitive):
+        self.column = column
+        self.operator = operator
+        self.text = text
+        self.number = number
+        self.case_insensitive = case_insensitive
+
+    def mask(self, frame):
+        column = frame[self.column]
+        if self.operator in ('contains', 'datestartswith'):
+            values = column.astype(str)
+            text = self.text
+            if self.case_insensitive:
+                values = values.str.lower()
+                text = text.lower()
+            if self.operator == 'contains':
+                return values.str.contains(text, regex=False).to_numpy(dtype=bool)
+            return values.str.startswith(text).to_numpy(dtype=bool)
+        value = self.number
+        if value is None or column.dtype == object:
+            value = self.text
+            if column.dtype != object:
+                return np.zeros(len(frame), dtype=bool)
+            column = column.astype(str)
+            if self.case_insensitive:
+                column = column.str.lower()
+                value = value.lower()
+        return getattr(column, self.operator)(value).to_numpy(dtype=bool)
+
+
+class FilterPlan:
+
+    def __init__(self, clauses):
+        self.clauses = tuple(clauses)
+
+    def mask(self, frame):
+        mask = np.ones(len(frame), dtype=bool)
+        for clause in self.clauses:
+            if clause.column in frame.columns:
+                mask &= clause.mask(frame)
+        return mask
+
+    def rows(self, frame):
+        if not self.clauses:
+            return np.arange(len(frame))
+        return np.flatnonzero(self.mask(frame))
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(filter_query):
+    '''
+    Compile a DataTable filter_query, reusing the plan of a query text already seen
+    '''
+    clauses = []
+    for part in (filter_query or '').split(' && '):
+        m = _clause_re.match(part)
+        if not m or not m.group('value'):
+            continue
+        text, number = _parse_value(m.group('value'))
+        clauses.append(FilterClause(m.group('column'), OPERATORS[m.group('operator')], text, number,
+                                    m.group('case') == 'i'))
+    return FilterPlan(clauses)
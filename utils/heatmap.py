@@ -0,0 +1,202 @@
+import numpy as np
+
+from utils.lru import LRUCache
+
+# modules with more cells than this are drawn locally at screen resolution
+LOD_MAX_CELLS = 100000
+LOD_MAX_ROWS = 400
+LOD_MAX_COLUMNS = 200
+MAX_TICK_LABELS = 100
+
+
+def _leading_order(values, iterations=20):
+    '''
+    Order rows and columns by the leading singular vectors of the (NaN filled, centered) matrix,
+    computed by power iteration so that it stays O(rows x columns)
+    '''
+    filled = np.where(np.isnan(values), 0.0, values)
+    filled = filled - filled.mean(axis=1, keepdims=True)
+    v = np.ones(filled.shape[1]) / np.sqrt(filled.shape[1])
+    for _ in range(iterations):
+        u = filled @ v
+        norm = np.linalg.norm(u)
+        if norm == 0:
+            break
+        u /= norm
+        v = filled.T @ u
+        v /= np.linalg.norm(v) or 1.0
+    u = filled @ v
+    return np.argsort(u, kind='stable'), np.argsort(v, kind='stable')
+
+
+def _edges(n, max_bins):
+    return np.unique(np.linspace(0, n, min(n, max_bins) + 1).astype(int))
+
+
+def block_mean(values, row_edges, col_edges):
+    '''
+    NaN-aware mean of the blocks delimited by row_edges and col_edges
+    '''
+    finite = ~np.isnan(values)
+    filled = np.where(finite, values, 0.0)
+    total = np.add.reduceat(np.add.reduceat(filled, row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    count = np.add.reduceat(np.add.reduceat(finite.astype(np.int32), row_edges[:-1], axis=0), col_edges[:-1], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def changes_view(relayout):
+    '''
+    Whether a relayoutData event zooms, pans or resets the axes, rather than changing the
+    drag mode, the size or anything else that leaves the visible cells as they are
+    '''
+    return any(k in relayout for k in ('xaxis.autorange', 'yaxis.autorange', 'xaxis.range[0]', 'yaxis.range[0]'))
+
+
+def relayout_window(relayout, n_rows, n_columns):
+    '''
+    Visible (row_start, row_stop, column_start, column_stop) from a relayoutData event,
+    None when the user zoomed back out
+    '''
+    if not relayout or 'xaxis.autorange' in relayout or 'yaxis.autorange' in relayout:
+        return None
+    if 'xaxis.range[0]' not in relayout and 'yaxis.range[0]' not in relayout:
+        return None
+    x0 = relayout.get('xaxis.range[0]', -0.5)
+    x1 = relayout.get('xaxis.range[1]', n_columns - 0.5)
+    y0, y1 = sorted((relayout.get('yaxis.range[0]', -0.5), relayout.get('yaxis.range[1]', n_rows - 0.5)))
+    x0, x1 = sorted((x0, x1))
+    c0 = max(int(np.floor(x0 + 0.5)), 0)
+    c1 = min(int(np.ceil(x1 + 0.5)), n_columns)
+    r0 = max(int(np.floor(y0 + 0.5)), 0)
+    r1 = min(int(np.ceil(y1 + 0.5)), n_rows)
+    if c0 >= c1 or r0 >= r1:
+        return None
+    return r0, r1, c0, c1
+
+
+class HeatmapLOD:
+    '''
+    Level-of-detail view of a large module: the matrix in a fixed row and column order, drawn
+    as block means at screen resolution and as a full resolution window once the user zooms in.
+    Axes are cell indices in that order; row_ids and column_ids translate clicks back to ids.
+    '''
+
+    def __init__(self, module):
+        values = np.asarray(module.values, dtype=float)
+        rows, columns = _leading_order(values)
+        self.values = values[rows][:, columns]
+        self.row_ids = [module.biological_features[i].id for i in rows]
+        self.row_names = [module.biological_features[i].name for i in rows]
+        self.column_ids = [module.sample_sets[i].id for i in columns]
+        self.column_names = [module.sample_sets[i].name for i in columns]
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def _figure(self, z, x, y, zmin, zmax, labels=False):
+        xaxis = {'showticklabels': False, 'zeroline': False, 'showgrid': False}
+        yaxis = {'showticklabels': False, 'zeroline': False, 'showgrid': False, 'autorange': 'reversed'}
+        if labels and len(x) <= MAX_TICK_LABELS:
+            xaxis.update(showticklabels=True, tickvals=x, ticktext=[self.column_names[i] for i in x])
+        if labels and len(y) <= MAX_TICK_LABELS:
+            yaxis.update(showticklabels=True, tickvals=y, ticktext=[self.row_names[i] for i in y])
+        return {
+            'data': [{
+                'type': 'heatmapgl',
+                'z': np.round(z, 3),
+                'x': x,
+                'y': y,
+                'zmin': zmin,
+                'zmax': zmax,
+                'colorscale': 'RdBu',
+                'reversescale': True,
+            }],
+            'layout': {
+                'uirevision': 'heatmap',
+                'plot_bgcolor': 'rgba(100,100,100,100)',
+                'height': 800,
+                'xaxis': xaxis,
+                'yaxis': yaxis,
+            },
+        }
+
+    def overview(self, zmin, zmax):
+        n_rows, n_columns = self.shape
+        row_edges = _edges(n_rows, LOD_MAX_ROWS)
+        col_edges = _edges(n_columns, LOD_MAX_COLUMNS)
+        z = block_mean(self.values, row_edges, col_edges)
+        x = (col_edges[:-1] + col_edges[1:] - 1) / 2.0
+        y = (row_edges[:-1] + row_edges[1:] - 1) / 2.0
+        return self._figure(z, x, y, zmin, zmax)
+
+    def window(self, relayout, zmin, zmax):
+        n_rows, n_columns = self.shape
+        window = relayout_window(relayout, n_rows, n_columns)
+        if window is None:
+            return self.overview(zmin, zmax)
+        r0, r1, c0, c1 = window
+        if (r1 - r0) * (c1 - c0) > LOD_MAX_CELLS:
+            # still too many cells: aggregate only the visible part
+            row_edges = _edges(r1 - r0, LOD_MAX_ROWS)
+            col_edges = _edges(c1 - c0, LOD_MAX_COLUMNS)
+            z = block_mean(self.values[r0:r1, c0:c1], row_edges, col_edges)
+            x = c0 + (col_edges[:-1] + col_edges[1:] - 1) / 2.0
+            y = r0 + (row_edges[:-1] + row_edges[1:] - 1) / 2.0
+            return self._figure(z, x, y, zmin, zmax)
+        return self._figure(self.values[r0:r1, c0:c1], np.arange(c0, c1), np.arange(r0, r1), zmin, zmax, labels=True)
+
+    def ids_at(self, x, y):
+        '''
+        (biological feature id, sample set id) of the cell under a click
+        '''
+        r = min(max(int(round(y)), 0), len(self.row_ids) - 1)
+        c = min(max(int(round(x)), 0), len(self.column_ids) - 1)
+        return self.row_ids[r], self.column_ids[c]
+
+
+def heatmap_scale(module, get_stats):
+    '''
+    Colour scale (min, max) of the module heatmap, read from the module ModuleStats returned by
+    get_stats(), which is only called for the normalizations without a fixed scale
+    '''
+    if module.compendium.normalization == 'tpm':
+        stats = get_stats()
+        return stats.percentile(1), stats.percentile(95)
+    return -5, 5
+
+
+class HeatmapCache:
+    '''
+    Everything the Heatmap tab needs per module version: the colour scale, the LOD view of large
+    modules and the finished figures, keyed by (module version, min, max, normalization, window)
+    '''
+
+    def __init__(self, max_figures=32, max_views=16):
+        self._scales = LRUCache(max_entries=256)
+        self._views = LRUCache(max_entries=max_views)
+        self._figures = LRUCache(max_entries=max_figures)
+
+    @staticmethod
+    def use_lod(module):
+        return len(module.biological_features) * len(module.sample_sets) > LOD_MAX_CELLS
+
+    def scale(self, module_version, module, get_stats):
+        return self._scales.get_or_create(module_version, lambda: heatmap_scale(module, get_stats))
+
+    def get(self, module_version, module):
+        return self._views.get_or_create(module_version, lambda: HeatmapLOD(module))
+
+    def figure(self, module_version, module, get_stats, relayout, build):
+        '''
+        Finished figure of the module, calling build(min, max) for modules drawn by the server
+        '''
+        zmin, zmax = self.scale(module_version, module, get_stats)
+        if self.use_lod(module):
+            lod = self.get(module_version, module)
+            window = relayout_window(relayout, *lod.shape)
+            key = (module_version, zmin, zmax, module.compendium.normalization, window)
+            return self._figures.get_or_create(key, lambda: lod.window(relayout, zmin, zmax))
+        key = (module_version, zmin, zmax, module.compendium.normalization, None)
+        return self._figures.get_or_create(key, lambda: build(zmin, zmax))
@@ -0,0 +1,167 @@
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+JOB_MAX_AGE = 24 * 3600
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobTable:
+    '''
+    Status of every job in a SQLite file, written by the processes running the jobs and read by
+    any gunicorn worker polling them. Results are pickled next to it.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.folder = os.path.splitext(filename)[0]
+        self._local = threading.local()
+        os.makedirs(self.folder, exist_ok=True)
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, session_id TEXT, kind TEXT, '
+                       'status TEXT, progress REAL, message TEXT, error TEXT, created REAL, updated REAL)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.filename, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def _result_path(self, job_id):
+        return os.path.join(self.folder, job_id + '.pkl')
+
+    def create(self, job_id, session_id, kind):
+        now = time.time()
+        with self._db() as db:
+            db.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, 0, ?, NULL, ?, ?)',
+                       (job_id, session_id, kind, QUEUED, 'Waiting for a free worker', now, now))
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        columns = ', '.join(k + ' = ?' for k in fields)
+        with self._db() as db:
+            db.execute('UPDATE jobs SET ' + columns + ' WHERE id = ?', list(fields.values()) + [job_id])
+
+    def get(self, job_id):
+        row = self._db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def set_result(self, job_id, result):
+        path = self._result_path(job_id)
+        tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'wb') as fo:
+            pickle.dump(result, fo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def result(self, job_id):
+        with open(self._result_path(job_id), 'rb') as fi:
+            return pickle.load(fi)
+
+    def purge(self, max_age=JOB_MAX_AGE):
+        limit = time.time() - max_age
+        with self._db() as db:
+            old = [row['id'] for row in db.execute('SELECT id FROM jobs WHERE updated < ?', (limit,))]
+            db.execute('DELETE FROM jobs WHERE updated < ?', (limit,))
+        for job_id in old:
+            try:
+                os.remove(self._result_path(job_id))
+            except OSError:
+                pass
+
+
+class Progress:
+    '''
+    Passed to job functions as their first argument: progress(fraction, message)
+    '''
+
+    def __init__(self, table, job_id):
+        self.table = table
+        self.job_id = job_id
+
+    def __call__(self, fraction, message=''):
+        self.table.update(self.job_id, progress=fraction, message=message)
+
+
+def _run_job(filename, job_id, fn, args):
+    table = JobTable(filename)
+    table.update(job_id, status=RUNNING, message='Started')
+    try:
+        result = fn(Progress(table, job_id), *args)
+        table.set_result(job_id, result)
+        table.update(job_id, status=DONE, progress=1.0, message='Done')
+    except Exception as e:
+        table.update(job_id, status=FAILED, message=str(e), error=traceback.format_exc())
+
+
+class JobQueue:
+    '''
+    Long running operations run in a pool of processes, so that gunicorn workers stay free for
+    interactive requests. submit() returns a job id at once; the job status, progress and result
+    are read back from the job table by whichever worker the browser polls.
+
+    Jobs are plain functions fn(progress, *args) with picklable arguments and result.
+    initializer(*initargs) runs once in every process of the pool.
+    '''
+
+    def __init__(self, filename, max_workers=2, initializer=None, initargs=()):
+        self.table = JobTable(filename)
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+        self._lock = threading.Lock()
+        self._last_purge = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: a forked child would share the parent's SQLite connections and locks
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=self.initializer, initargs=self.initargs)
+            return self._executor
+
+    def submit(self, session_id, kind, fn, *args):
+        job_id = uuid.uuid4().hex
+        self.table.create(job_id, session_id, kind)
+        future = self._pool().submit(_run_job, self.table.filename, job_id, fn, args)
+        future.add_done_callback(lambda f: self._check(job_id, f))
+        self.purge()
+        return job_id
+
+    def _check(self, job_id, future):
+        # the process running the job died before it could record the failure
+        if future.exception() is not None:
+            self.table.update(job_id, status=FAILED, message='The job was interrupted',
+                              error=repr(future.exception()))
+            with self._lock:
+                self._executor = None
+
+    def get(self, job_id, session_id=None):
+        job = self.table.get(job_id) if job_id else None
+        if job is None or (session_id is not None and job['session_id'] != session_id):
+            return None
+        return job
+
+    def result(self, job_id):
+        return self.table.result(job_id)
+
+    def purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        self.table.purge()
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pycompass import BiologicalFeature, Module, SampleSet
+
+from utils.module_values import splice_values
+
+KINDS = {
+    'biological_features': BiologicalFeature,
+    'sample_sets': SampleSet,
+}
+
+
+class ModuleEdit:
+    '''
+    Biological features and sample sets, by name, queued to be added to or removed from the
+    module of a session, and applied all together by commit() so that the module values are
+    fetched once for the whole batch
+    '''
+
+    def __init__(self, add=None, remove=None):
+        self.add = {kind: list((add or {}).get(kind, [])) for kind in KINDS}
+        self.remove = {kind: list((remove or {}).get(kind, [])) for kind in KINDS}
+
+    def __bool__(self):
+        return any(self.add.values()) or any(self.remove.values())
+
+    def queue(self, action, kind, names):
+        '''
+        Queue names to 'add' or 'remove'; a name queued for the opposite action is dropped from it
+        '''
+        queued, opposite = (self.add, self.remove) if action == 'add' else (self.remove, self.add)
+        for name in names:
+            if not name:
+                continue
+            if name in opposite[kind]:
+                opposite[kind].remove(name)
+            if name not in queued[kind]:
+                queued[kind].append(name)
+
+    def clear(self):
+        for kind in KINDS:
+            self.add[kind] = []
+            self.remove[kind] = []
+
+    def _changes(self, module, kind):
+        current = {o.name for o in getattr(module, kind)}
+        add = [n for n in self.add[kind] if n not in current]
+        remove = [n for n in self.remove[kind] if n in current]
+        return current, add, remove
+
+    def preview(self, module):
+        '''
+        {kind: (added, removed, size after commit)} computed locally. Added names not found in
+        the compendium are only discovered at commit time, so sizes are upper bounds.
+        '''
+        preview = {}
+        for kind in KINDS:
+            current, add, remove = self._changes(module, kind)
+            preview[kind] = (len(add), len(remove), len(current) + len(add) - len(remove))
+        return preview
+
+    def commit(self, module, compendium):
+        '''
+        New module with the queued changes applied to module, which is left untouched, or None
+        when nothing changes. All the added names are looked up in one query per kind, run
+        concurrently, and only the values of the added rows and columns are fetched.
+        '''
+        changes = {kind: self._changes(module, kind) for kind in KINDS}
+        with ThreadPoolExecutor(max_workers=len(KINDS)) as executor:
+            found = {kind: executor.submit(cls.using(compendium).get, filter={'name_In': changes[kind][1]})
+                     for kind, cls in KINDS.items() if changes[kind][1]}
+            found = {kind: f.result() for kind, f in found.items()}
+        objects = {}
+        for kind in KINDS:
+            _, add, remove = changes[kind]
+            objects[kind] = list(getattr(module, kind))
+            ids = {o.id for o in objects[kind]}
+            added = [o for o in found.get(kind, []) if o.id not in ids]
+            if remove or added:
+                removed = set(remove)
+                objects[kind] = [o for o in objects[kind] if o.name not in removed] + added
+        if all(len(objects[kind]) == len(getattr(module, kind)) and
+               all(a is b for a, b in zip(objects[kind], getattr(module, kind))) for kind in KINDS):
+            return None
+        changed = Module.__new__(Module)
+        changed.__dict__.update(module.__dict__)
+        changed.biological_features = objects['biological_features']
+        changed.sample_sets = objects['sample_sets']
+        changed.__normalized_values__ = splice_values(changed, [bf.id for bf in module.biological_features],
+                                                      [ss.id for ss in module.sample_sets],
+                                                      module.__normalized_values__)
+        return changed
+
+    def dump(self):
+        return {'add': self.add, 'remove': self.remove}
+
+    @staticmethod
+    def load(data):
+        return ModuleEdit(**data) if data else ModuleEdit()
@@ -0,0 +1,93 @@
+import numpy as np
+
+from pycompass import Compendium, Connect, BiologicalFeature, Module, SampleSet
+
+###
+# pyCOMPASS objects can't be pickled directly (BiologicalFeature.__getattr__ goes to the
+# network for any missing attribute, __setstate__ included), so modules and compendia are
+# converted to plain dicts of their attributes and rebuilt without calling __init__.
+
+COMPENDIUM_FIELDS = ('compendium_name', 'compendium_full_name', 'description', 'version', 'version_alias',
+                     'database', 'normalization')
+
+
+def dump_compendium(compendium):
+    if compendium is None:
+        return None
+    data = {k: getattr(compendium, k) for k in COMPENDIUM_FIELDS}
+    data['url'] = compendium.connection.url
+    return data
+
+
+def load_compendium(data, connection=None):
+    '''
+    Compendium of data on connection; the stored url is only used when there is no connection,
+    so that data can never point the server to another host
+    '''
+    if data is None:
+        return None
+    data = dict(data)
+    url = data.pop('url')
+    if connection is None:
+        connection = Connect(url)
+    return Compendium.__factory_build_object__(connection=connection, **data)
+
+
+def _dump_object(obj):
+    return {k: v for k, v in obj.__dict__.items() if k != 'compendium'}
+
+
+def _load_object(cls, data, compendium):
+    obj = cls.__new__(cls)
+    obj.__dict__.update(data)
+    obj.__dict__['compendium'] = compendium
+    return obj
+
+
+def dump_module(module):
+    if module is None:
+        return None
+    data = {k: v for k, v in module.__dict__.items()
+            if k not in ('compendium', 'biological_features', 'sample_sets')}
+    data['compendium'] = dump_compendium(module.compendium)
+    data['biological_features'] = [_dump_object(bf) for bf in module.biological_features or []]
+    data['sample_sets'] = [_dump_object(ss) for ss in module.sample_sets or []]
+    return data
+
+
+def load_module(data, connection=None):
+    if data is None:
+        return None
+    data = dict(data)
+    compendium = load_compendium(data.pop('compendium'), connection)
+    module = Module.__new__(Module)
+    module.biological_features = [_load_object(BiologicalFeature, bf, compendium) for bf in data.pop('biological_features')]
+    module.sample_sets = [_load_object(SampleSet, ss, compendium) for ss in data.pop('sample_sets')]
+    module.__dict__.update(data)
+    module.compendium = compendium
+    return module
+
+
+def snapshot_module(module):
+    '''
+    Copy of module with its own lists of biological features and sample sets. The values are
+    shared: modules get new values arrays, never changed ones, and memory-mapped values stay
+    on disk.
+    '''
+    if module is None:
+        return None
+    snapshot = Module.__new__(Module)
+    snapshot.__dict__.update(module.__dict__)
+    snapshot.biological_features = list(module.biological_features)
+    snapshot.sample_sets = list(module.sample_sets)
+    return snapshot
+
+
+def module_nbytes(module):
+    if module is None:
+        return 0
+    values = module.__dict__.get('__normalized_values__')
+    # memory-mapped values live in the page cache, not in the worker
+    size = values.nbytes if isinstance(values, np.ndarray) and not isinstance(values, np.memmap) else 0
+    # rough per-object overhead for the attribute dicts of features and sample sets
+    return size + 1024 * (len(module.biological_features or []) + len(module.sample_sets or []))
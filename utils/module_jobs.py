@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pycompass import BiologicalFeature, Experiment, Module, Sample, SampleSet, query
+
+from utils.backend import http_session, install_run_query, session_run_query
+from utils.module_io import dump_module, load_compendium, load_module
+from utils.query_cache import QueryCache
+
+###
+# Functions run by the JobQueue pool processes. Compendia and modules travel as the plain dicts
+# of utils/module_io.py since pyCOMPASS objects can't be pickled.
+
+
+def init_worker(query_cache_file, memory_bytes, http_options):
+    '''
+    Pool process initializer: share the GraphQL response cache of the web workers and keep
+    connections to COMPASS open between jobs
+    '''
+    query_cache = QueryCache(query_cache_file, memory_bytes=memory_bytes)
+    install_run_query(query_cache.wrap(session_run_query(http_session(**http_options))))
+
+
+NAME_BATCH = 200
+NAME_WORKERS = 8
+
+_SPARQL_BIOFEATURES = '''{{
+    sparql(compendium:"{compendium}", version:"{version}", database:"{database}", normalization:"{normalization}",
+        query:"{sparql}", target:"biofeature") {{
+        rdfTriples
+    }}
+}}'''
+
+
+def _by_name(compendium, names):
+    return BiologicalFeature.using(compendium).get(filter={'name_In': names})
+
+
+def _by_alias(compendium, names):
+    # BiologicalFeature.by(sparql=...) fails when nothing matches, so the SPARQL query is sent here
+    alias = ["{{?s <http://purl.obolibrary.org/obo/NCIT_C41095> '{n}'}}".format(n=n) for n in names]
+    sparql = 'SELECT ?s ?p ?o WHERE {{ {alias} }}'.format(alias=' UNION '.join(alias))
+    response = query.run_query(compendium.connection.url, _SPARQL_BIOFEATURES.format(
+        compendium=compendium.compendium_name, version=compendium.version, database=compendium.database,
+        normalization=compendium.normalization, sparql=sparql))
+    ids = {i for triple in response['data']['sparql']['rdfTriples'] for i in triple if i is not None}
+    if not ids:
+        return []
+    return BiologicalFeature.using(compendium).get(filter={'id_In': list(ids)})
+
+
+def _biofeatures_by_name(compendium, names):
+    '''
+    Biological features named, or with an NCIT_C41095 alias, in names. Names are looked up in
+    batches of NAME_BATCH, the name and alias queries of every batch running concurrently.
+    '''
+    names = list(dict.fromkeys(names))
+    batches = [names[i:i + NAME_BATCH] for i in range(0, len(names), NAME_BATCH)]
+    with ThreadPoolExecutor(max_workers=min(NAME_WORKERS, 2 * len(batches) or 1)) as executor:
+        futures = [executor.submit(lookup, compendium, batch) for lookup in (_by_name, _by_alias) for batch in batches]
+        found = [bf for f in futures for bf in f.result()]
+    # name matches first, as they come before alias matches in the futures
+    bf, bf_ids = [], set()
+    for _bf in found:
+        if _bf.id not in bf_ids:
+            bf_ids.add(_bf.id)
+            bf.append(_bf)
+    return bf
+
+
+def create_module(progress, compendium_data, search, value, target=None):
+    '''
+    Module from a quick search ('biofeatures': comma separated names), an experiment search
+    ('experiments': comma separated accession ids) or a SPARQL query on samples or biological
+    features ('sparql')
+    '''
+    compendium = load_compendium(compendium_data)
+    progress(0.1, 'Searching the compendium')
+    if search == 'biofeatures':
+        names = [x.strip() for x in value.split(',')]
+        kwargs = {'biofeatures': _biofeatures_by_name(compendium, names)}
+    elif search == 'experiments':
+        exp_id = [x.strip() for x in value.split(',')]
+        e = Experiment.using(compendium).get(filter={'experimentAccessId_In': exp_id})
+        kwargs = {'samplesets': SampleSet.using(compendium).get(filter={"experiments": [x.id for x in e]})}
+    else:
+        sparql = ' '.join([x for x in value.strip().split('\n') if not x.strip().startswith('#')])
+        if target == 'sample':
+            s = Sample.using(compendium).by(sparql=sparql)
+            kwargs = {'samplesets': SampleSet.using(compendium).by(samples=s)}
+        else:
+            kwargs = {'biofeatures': BiologicalFeature.using(compendium).by(sparql=sparql)}
+    progress(0.4, 'Creating the module')
+    module = Module.using(compendium).create(**kwargs)
+    progress(0.7, 'Downloading the module values')
+    module.values
+    return dump_module(module)
+
+
+def rank(progress, compendium_data, module_data, target, rank_method):
+    '''
+    (ids, names, scores) of all the sample sets or biological features ranked against module
+    '''
+    compendium = load_compendium(compendium_data)
+    module = load_module(module_data)
+    progress(0.2, 'Ranking ' + target.replace('_', ' '))
+    if target == 'sample_sets':
+        ranking = compendium.rank_sample_sets(module, rank_method=rank_method)
+    else:
+        ranking = compendium.rank_biological_features(module, rank_method=rank_method)
+    ranking = ranking['ranking']
+    return list(ranking['id']), list(ranking['name']), list(ranking['value'])
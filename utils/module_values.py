@@ -0,0 +1,62 @@
+import numpy as np
+
+from pycompass import query
+
+_MODULE_VALUES = '''\
+    {{\
+        modules(compendium:"{compendium}", version:"{version}", database:"{database}", normalization:"{normalization}", biofeaturesIds:[{bf}], samplesetIds:[{ss}]) {{\
+            normalizedValues, biofeatures {{ edges {{ node {{ id }} }} }}, sampleSets {{ edges {{ node {{ id }} }} }}\
+        }}\
+    }}\
+'''
+
+
+def fetch_values(compendium, bf_ids, ss_ids):
+    '''
+    Values of the bf_ids x ss_ids block, rows and columns in the given order. Pairs COMPASS
+    doesn't return are NaN.
+    '''
+    block = np.full((len(bf_ids), len(ss_ids)), np.nan)
+    if not bf_ids or not ss_ids:
+        return block
+    response = query.run_query(compendium.connection.url, _MODULE_VALUES.format(
+        compendium=compendium.compendium_name, version=compendium.version, database=compendium.database,
+        normalization=compendium.normalization,
+        bf=','.join('"' + i + '"' for i in bf_ids), ss=','.join('"' + i + '"' for i in ss_ids)))
+    modules = response['data']['modules']
+    values = np.array(modules['normalizedValues'], dtype=float)
+    rows = {i: n for n, i in enumerate(bf_ids)}
+    columns = {i: n for n, i in enumerate(ss_ids)}
+    got_rows = [rows[e['node']['id']] for e in modules['biofeatures']['edges']]
+    got_columns = [columns[e['node']['id']] for e in modules['sampleSets']['edges']]
+    if values.size:
+        block[np.ix_(got_rows, got_columns)] = values.reshape(len(got_rows), len(got_columns))
+    return block
+
+
+def splice_values(module, old_bf_ids, old_ss_ids, old_values):
+    '''
+    Values of module, whose biological features and sample sets were changed from old_bf_ids
+    and old_ss_ids, built from old_values: removed rows and columns are sliced out locally and
+    only the new ones are fetched, so the cost follows the size of the change and not of the
+    module. None when there is nothing to start from.
+    '''
+    if old_values is None or np.size(old_values) == 0:
+        return None
+    bf_ids = [bf.id for bf in module.biological_features]
+    ss_ids = [ss.id for ss in module.sample_sets]
+    old_rows = {i: n for n, i in enumerate(old_bf_ids)}
+    old_columns = {i: n for n, i in enumerate(old_ss_ids)}
+    kept_rows = [n for n, i in enumerate(bf_ids) if i in old_rows]
+    kept_columns = [n for n, i in enumerate(ss_ids) if i in old_columns]
+    new_rows = [n for n, i in enumerate(bf_ids) if i not in old_rows]
+    new_columns = [n for n, i in enumerate(ss_ids) if i not in old_columns]
+
+    values = np.empty((len(bf_ids), len(ss_ids)))
+    values[np.ix_(kept_rows, kept_columns)] = np.asarray(old_values)[np.ix_(
+        [old_rows[bf_ids[n]] for n in kept_rows], [old_columns[ss_ids[n]] for n in kept_columns])]
+    # new rows against every column, then kept rows against the new columns
+    values[new_rows, :] = fetch_values(module.compendium, [bf_ids[n] for n in new_rows], ss_ids)
+    values[np.ix_(kept_rows, new_columns)] = fetch_values(
+        module.compendium, [bf_ids[n] for n in kept_rows], [ss_ids[n] for n in new_columns])
+    return values
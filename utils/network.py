@@ -0,0 +1,301 @@
+import numpy as np
+
+from utils.lru import LRUCache
+
+# strongest correlations kept per module, whatever the slider says
+MAX_EDGES = 200000
+BLOCK_ROWS = 512
+# strongest edges per node used to compute the layout
+LAYOUT_EDGES_PER_NODE = 10
+
+
+# fewest columns two rows must share to be correlated
+MIN_PAIRS = 3
+
+
+def standardize(values):
+    '''
+    Rows centered on their mean and scaled to unit norm, so that a dot product of two rows
+    without missing values is their Pearson correlation
+    '''
+    values = np.asarray(values, dtype=float)
+    centered = values - values.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(centered, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return centered / norm
+
+
+def correlation_blocks(values, block_rows=BLOCK_ROWS):
+    '''
+    (start, r) for consecutive blocks of rows, r being the Pearson correlation of the rows
+    start:start + block_rows with the rows start:. With missing values every pair is correlated
+    over the columns both rows have, from masked counts and sums, and pairs sharing fewer than
+    MIN_PAIRS columns get 0.
+    '''
+    values = np.asarray(values, dtype=float)
+    n = values.shape[0]
+    observed = ~np.isnan(values)
+    if observed.all():
+        z = standardize(values)
+        for start in range(0, n, block_rows):
+            yield start, z[start:start + block_rows] @ z[start:].T
+        return
+    with np.errstate(invalid='ignore'):
+        mean = np.nanmean(values, axis=1, keepdims=True)
+    # centering first keeps the sums small
+    x = np.where(observed, values - np.nan_to_num(mean), 0.0)
+    m = observed.astype(float)
+    x2 = x * x
+    # six products per block instead of one: smaller blocks for the same memory
+    block_rows = max(1, block_rows // 4)
+    for start in range(0, n, block_rows):
+        stop = min(start + block_rows, n)
+        xa, ma, xb, mb = x[start:stop], m[start:stop], x[start:], m[start:]
+        count = ma @ mb.T
+        sx = xa @ mb.T
+        sy = ma @ xb.T
+        cov = count * (xa @ xb.T) - sx * sy
+        var = (count * (x2[start:stop] @ mb.T) - sx * sx) * (count * (ma @ x2[start:].T) - sy * sy)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = cov / np.sqrt(var)
+        r[~(var > 0) | (count < MIN_PAIRS)] = 0.0
+        yield start, r
+
+
+class EdgeIndex:
+    '''
+    All the gene pairs of a module sorted by decreasing |Pearson r|, computed once in blocks of
+    rows (see correlation_blocks) so that the full correlation matrix is never held in memory. Only the max_edges
+    strongest pairs are kept. The edges above any threshold are a prefix of the arrays,
+    found with a binary search.
+    '''
+
+    def __init__(self, values, max_edges=MAX_EDGES):
+        floor = 0.0
+        sources, targets, rs = [], [], []
+        kept = 0
+        for start, block in correlation_blocks(values):
+            # keep the upper triangle only
+            i, j = np.nonzero(np.triu(np.abs(block) >= floor, k=1))
+            r = block[i, j]
+            sources.append(i + start)
+            targets.append(j + start)
+            rs.append(r)
+            kept += len(r)
+            if kept > 2 * max_edges:
+                s, t, r = np.concatenate(sources), np.concatenate(targets), np.concatenate(rs)
+                top = np.argpartition(-np.abs(r), max_edges)[:max_edges]
+                sources, targets, rs = [s[top]], [t[top]], [r[top]]
+                floor = np.abs(r[top]).min()
+                kept = max_edges
+        s = np.concatenate(sources) if sources else np.zeros(0, dtype=int)
+        t = np.concatenate(targets) if targets else np.zeros(0, dtype=int)
+        r = np.concatenate(rs) if rs else np.zeros(0)
+        # more pairs than kept: thresholds below the weakest kept edge show a cut network
+        self.capped = floor > 0 or len(r) > max_edges
+        order = np.argsort(-np.abs(r), kind='stable')[:max_edges]
+        self.source = s[order]
+        self.target = t[order]
+        self.r = np.clip(r[order], -1.0, 1.0)
+        self._neg_abs_r = -np.abs(self.r)
+
+    def __len__(self):
+        return len(self.r)
+
+    def count(self, threshold):
+        '''
+        Number of edges with |r| >= threshold
+        '''
+        return int(np.searchsorted(self._neg_abs_r, -threshold, side='right'))
+
+    def truncated(self, threshold):
+        '''
+        True when edges with |r| >= threshold were dropped by max_edges
+        '''
+        return self.capped and self.count(threshold) == len(self)
+
+    @property
+    def weakest(self):
+        return float(-self._neg_abs_r[-1]) if len(self) else 0.0
+
+    def edges(self, threshold):
+        k = self.count(threshold)
+        return self.source[:k], self.target[:k], self.r[:k]
+
+
+def circular_layout(n):
+    angle = 2 * np.pi * np.arange(n) / max(n, 1)
+    return np.column_stack([np.cos(angle), np.sin(angle)])
+
+
+def strongest_per_node(n, source, target, k):
+    '''
+    Mask of the edges (sorted by decreasing strength) that are among the k strongest of at
+    least one of their two nodes
+    '''
+    nodes = np.concatenate([source, target])
+    edges = np.concatenate([np.arange(len(source)), np.arange(len(target))])
+    order = np.argsort(nodes, kind='stable')
+    nodes, edges = nodes[order], edges[order]
+    starts = np.searchsorted(nodes, np.arange(n))
+    rank = np.arange(len(nodes)) - starts[nodes]
+    keep = np.zeros(len(source), dtype=bool)
+    keep[edges[rank < k]] = True
+    return keep
+
+
+def _normalize(xy):
+    xy = xy - xy.mean(axis=0)
+    scale = np.abs(xy).max(axis=0)
+    scale[scale == 0] = 1.0
+    return xy / scale
+
+
+def spectral_layout(n, source, target, weight, iterations=100, seed=0):
+    '''
+    2D positions from the two leading non trivial eigenvectors of the normalized adjacency
+    matrix of a weighted graph. The eigenvectors are found by subspace iteration with sparse
+    products over the edge list, so the cost is O(edges x iterations) rather than O(n^3).
+    Nodes without edges are placed on a circle around the graph.
+    '''
+    positions = 1.1 * circular_layout(n)
+    degree = np.bincount(source, weight, n) + np.bincount(target, weight, n)
+    connected = degree > 0
+    if connected.sum() < 3:
+        return positions
+    inv_sqrt = np.zeros(n)
+    inv_sqrt[connected] = 1.0 / np.sqrt(degree[connected])
+    w = weight * inv_sqrt[source] * inv_sqrt[target]
+    trivial = np.sqrt(degree)
+    trivial /= np.linalg.norm(trivial)
+
+    def multiply(x):
+        # (I + D^-1/2 W D^-1/2) x / 2, which has the same eigenvectors and no negative eigenvalue
+        y = x.copy()
+        np.add.at(y, source, w[:, None] * x[target])
+        np.add.at(y, target, w[:, None] * x[source])
+        return y / 2
+
+    x = np.random.RandomState(seed).rand(n, 2)
+    x[~connected] = 0
+    for _ in range(iterations):
+        x = multiply(x)
+        x -= np.outer(trivial, trivial @ x)
+        x, _ = np.linalg.qr(x)
+    positions[connected] = _normalize(x[connected] * inv_sqrt[connected, None])
+    return positions
+
+
+def force_directed_layout(positions, source, target, weight, iterations=50, samples=64, seed=0):
+    '''
+    Fruchterman-Reingold refinement of positions: attraction along the edges, repulsion from a
+    random sample of nodes at each iteration, so each step is O(edges + nodes x samples).
+    Only nodes with edges move.
+    '''
+    n = len(positions)
+    moving = np.zeros(n, dtype=bool)
+    moving[source] = True
+    moving[target] = True
+    index = np.flatnonzero(moving)
+    if len(index) < 3:
+        return positions
+    rs = np.random.RandomState(seed)
+    xy = positions.copy()
+    k = 2.0 / np.sqrt(len(index))
+    samples = min(samples, len(index))
+    for step in range(iterations):
+        temperature = 0.1 * (1 - step / float(iterations))
+        p = xy[index]
+        other = xy[rs.choice(index, samples, replace=False)]
+        delta = p[:, None, :] - other[None, :, :]
+        distance2 = (delta ** 2).sum(axis=2) + 1e-9
+        displacement = np.zeros_like(xy)
+        displacement[index] = (k * k * delta / distance2[:, :, None]).sum(axis=1) * (len(index) / float(samples))
+        delta = xy[source] - xy[target]
+        force = (weight * np.sqrt((delta ** 2).sum(axis=1)) / k)[:, None] * delta
+        np.add.at(displacement, source, -force)
+        np.add.at(displacement, target, force)
+        length = np.sqrt((displacement[index] ** 2).sum(axis=1)) + 1e-9
+        xy[index] += displacement[index] / length[:, None] * np.minimum(length, temperature)[:, None]
+    xy[index] = _normalize(xy[index])
+    return xy
+
+
+def network_layout(n, source, target, weight, per_node=LAYOUT_EDGES_PER_NODE):
+    '''
+    Layout of a co-expression network from its edges sorted by decreasing strength: the
+    strongest edges of every node are laid out spectrally and then relaxed with a few
+    force-directed steps
+    '''
+    keep = strongest_per_node(n, source, target, per_node)
+    source, target, weight = source[keep], target[keep], weight[keep]
+    positions = spectral_layout(n, source, target, weight)
+    return force_directed_layout(positions, source, target, weight)
+
+
+class ModuleNetwork:
+    '''
+    Co-expression network of the biological features of a module: node positions and the
+    edge index are computed once, so moving the threshold only adds or removes edges and nodes
+    stay where they are
+    '''
+
+    def __init__(self, module):
+        self.names = [bf.name for bf in module.biological_features]
+        self.edge_index = EdgeIndex(module.values)
+        e = self.edge_index
+        self.positions = network_layout(len(self.names), e.source, e.target, np.abs(e.r))
+
+    def _edge_trace(self, source, target, color, name):
+        xy = self.positions
+        x = np.column_stack([xy[source, 0], xy[target, 0], np.full(len(source), np.nan)]).ravel()
+        y = np.column_stack([xy[source, 1], xy[target, 1], np.full(len(source), np.nan)]).ravel()
+        return {
+            'type': 'scattergl',
+            'mode': 'lines',
+            'x': x,
+            'y': y,
+            'line': {'width': 0.5, 'color': color},
+            'hoverinfo': 'none',
+            'name': name,
+        }
+
+    def figure(self, threshold):
+        source, target, r = self.edge_index.edges(threshold)
+        positive = r > 0
+        nodes = {
+            'type': 'scattergl',
+            'mode': 'markers',
+            'x': self.positions[:, 0],
+            'y': self.positions[:, 1],
+            'text': self.names,
+            'hoverinfo': 'text',
+            'marker': {'size': 8},
+            'name': 'Biological features',
+        }
+        return {
+            'data': [
+                self._edge_trace(source[positive], target[positive], '#d62728', 'Positive correlation'),
+                self._edge_trace(source[~positive], target[~positive], '#1f77b4', 'Negative correlation'),
+                nodes,
+            ],
+            'layout': {
+                'uirevision': 'network',
+                'height': 800,
+                'showlegend': True,
+                'xaxis': {'visible': False},
+                'yaxis': {'visible': False, 'scaleanchor': 'x'},
+            },
+        }
+
+
+class NetworkCache:
+    '''
+    ModuleNetwork objects keyed by module version
+    '''
+
+    def __init__(self, max_entries=16):
+        self._networks = LRUCache(max_entries=max_entries)
+
+    def get(self, module_version, module):
+        return self._networks.get_or_create(module_version, lambda: ModuleNetwork(module))
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# seconds a response stays valid, by root field of the GraphQL query; queries on any other
+# root field, and mutations, are never cached
+QUERY_TTL = {
+    'version': 3600,
+    'compendia': 3600,
+    'biofeatures': 24 * 3600,
+    'sampleSets': 24 * 3600,
+    'samples': 24 * 3600,
+    'experiments': 24 * 3600,
+    'platforms': 24 * 3600,
+    'ontology': 24 * 3600,
+    'dataSources': 24 * 3600,
+    'platformTypes': 24 * 3600,
+    'annotationPrettyPrint': 24 * 3600,
+    'biofeatureAnnotations': 24 * 3600,
+    'sampleAnnotations': 24 * 3600,
+    'scoreRankMethods': 24 * 3600,
+    'plotName': 24 * 3600,
+    'sparql': 3600,
+    'ranking': 3600,
+    'modules': 3600,
+    'plotHeatmap': 3600,
+    'plotNetwork': 3600,
+    'plotDistribution': 3600,
+}
+_root_field_re = re.compile(r'^\s*(?:query\s*)?\{\s*(\w+)')
+_argument_re = {k: re.compile(k + r'\s*:\s*"([^"]*)"') for k in ('compendium', 'version', 'database', 'normalization')}
+
+
+def query_entity(query):
+    m = _root_field_re.match(query)
+    return m.group(1) if m else None
+
+
+def query_key(url, query):
+    '''
+    Cache key made of endpoint, compendium, version, database, normalization and the query text
+    with insignificant whitespace removed
+    '''
+    parts = [url]
+    for k, r in _argument_re.items():
+        m = r.search(query)
+        parts.append(m.group(1) if m else '')
+    parts.append(' '.join(query.split()))
+    return hashlib.sha256('\x00'.join(parts).encode('utf8')).hexdigest()
+
+
+class QueryCache:
+    '''
+    Two-tier cache of GraphQL responses: an in-process LRU of at most memory_bytes in front of
+    a SQLite file shared by all the gunicorn workers. Responses are kept as JSON text and decoded
+    on every hit, so callers are free to modify what they get back.
+    '''
+
+    def __init__(self, filename, memory_bytes=128 * 1024 * 1024, ttl=None):
+        self.filename = filename
+        self.memory_bytes = memory_bytes
+        self.ttl = dict(QUERY_TTL, **(ttl or {}))
+        self._memory = OrderedDict()
+        self._memory_nbytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'errors': 0}
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, value BLOB)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.filename, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._memory[key]
+                self._memory_nbytes -= len(entry[1])
+                return None
+            self._memory.move_to_end(key)
+            return entry[1]
+
+    def _memory_put(self, key, expires, text):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_nbytes -= len(old[1])
+            self._memory[key] = (expires, text)
+            self._memory_nbytes += len(text)
+            while self._memory_nbytes > self.memory_bytes and self._memory:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_nbytes -= len(evicted)
+
+    def _disk_get(self, key):
+        try:
+            row = self._db().execute('SELECT expires, value FROM responses WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            self._count('errors')
+            return None, None
+        if row is None or row[0] < time.time():
+            return None, None
+        return row[0], zlib.decompress(row[1]).decode('utf8')
+
+    def _disk_put(self, key, expires, text):
+        try:
+            with self._db() as db:
+                db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                           (key, expires, zlib.compress(text.encode('utf8'))))
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+        except sqlite3.Error:
+            self._count('errors')
+
+    def get(self, key):
+        text = self._memory_get(key)
+        if text is not None:
+            self._count('memory_hits')
+            return json.loads(text)
+        expires, text = self._disk_get(key)
+        if text is not None:
+            self._count('disk_hits')
+            self._memory_put(key, expires, text)
+            return json.loads(text)
+        self._count('misses')
+        return None
+
+    def put(self, key, entity, response):
+        ttl = self.ttl.get(entity)
+        if not ttl:
+            return
+        text = json.dumps(response)
+        expires = time.time() + ttl
+        self._memory_put(key, expires, text)
+        self._disk_put(key, expires, text)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_nbytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def wrap(self, run_query):
+        '''
+        Return a run_query that answers from the cache and only calls run_query on a miss
+        '''
+        def cached_run_query(url, query, headers=None):
+            entity = query_entity(query)
+            # mutations don't match _root_field_re, so their entity is None
+            if entity is None or not self.ttl.get(entity):
+                return run_query(url, query, headers)
+            key = query_key(url, query)
+            response = self.get(key)
+            if response is None:
+                response = run_query(url, query, headers)
+                self.put(key, entity, response)
+            return response
+        return cached_run_query
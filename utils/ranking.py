@@ -0,0 +1,48 @@
+import numpy as np
+
+from utils.lru import LRUCache
+
+
+class Ranking:
+    '''
+    Full ranking of the sample sets or biological features of a compendium against a module,
+    sorted by decreasing score, so that applying a cutoff is a binary search
+    '''
+
+    def __init__(self, ids, names, values):
+        values = np.asarray(values, dtype=float)
+        order = np.argsort(-values, kind='stable')
+        self.ids = [ids[i] for i in order]
+        self.names = [names[i] for i in order]
+        self.values = values[order]
+        self._neg_values = -self.values
+
+    def __len__(self):
+        return len(self.names)
+
+    def count(self, cutoff):
+        '''
+        Number of entries with score >= cutoff; everything when there is no cutoff, as in
+        Compendium.rank_sample_sets
+        '''
+        if not cutoff:
+            return len(self.names)
+        return int(np.searchsorted(self._neg_values, -cutoff, side='right'))
+
+    def names_above(self, cutoff):
+        return self.names[:self.count(cutoff)]
+
+
+class RankingCache:
+    '''
+    Ranking objects keyed by (module version, target, rank method)
+    '''
+
+    def __init__(self, max_entries=64):
+        self._rankings = LRUCache(max_entries=max_entries)
+
+    def get(self, module_version, target, rank_method):
+        return self._rankings.get((module_version, target, rank_method))
+
+    def put(self, module_version, target, rank_method, ranking):
+        self._rankings.put((module_version, target, rank_method), ranking)
@@ -0,0 +1,331 @@
+import fcntl
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import flask
+import numpy as np
+
+from utils.module_edit import ModuleEdit
+from utils.module_io import dump_compendium, load_compendium, dump_module, load_module, module_nbytes
+
+SESSION_COOKIE = 'dashcompass_session'
+SESSION_MAX_AGE = 7 * 24 * 3600
+
+_session_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+def init_session(server):
+    '''
+    Give every browser a random session id cookie so that callbacks can find their own state
+    '''
+    @server.before_request
+    def _assign_session_id():
+        session_id = flask.request.cookies.get(SESSION_COOKIE)
+        if not session_id or not _session_id_re.match(session_id):
+            session_id = uuid.uuid4().hex
+            flask.g.new_session = True
+        flask.g.session_id = session_id
+
+    @server.after_request
+    def _set_session_cookie(response):
+        if flask.g.get('new_session'):
+            response.set_cookie(SESSION_COOKIE, flask.g.session_id, max_age=SESSION_MAX_AGE,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def get_session_id():
+    return flask.g.session_id
+
+
+class SessionState:
+    '''
+    Everything a single user works on: the selected compendium, the current module, the job
+    creating the next one, the changes queued on the module and the click counters of the
+    search buttons
+    '''
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.compendium = None
+        self.module = None
+        self.module_version = None
+        self.previous_module_version = None
+        self.module_job = None
+        self.module_edit = ModuleEdit()
+        self.n_clicks = {}
+
+    def set_module(self, module):
+        self.module = module
+        self.module_edit.clear()
+        self.touch()
+
+    def touch(self):
+        '''
+        Mark the module as changed. Its values should be fetched before entering
+        SessionStore.edit, so that no request to COMPASS runs while the session is locked.
+        '''
+        self.previous_module_version = self.module_version
+        self.module_version = uuid.uuid4().hex
+
+    def copy(self):
+        '''
+        State that can be changed without affecting this one; the module is shared, it is only
+        ever replaced, never changed in place
+        '''
+        state = SessionState(self.session_id)
+        state.__dict__.update(self.__dict__)
+        state.module_edit = ModuleEdit.load(self.module_edit.dump())
+        state.n_clicks = dict(self.n_clicks)
+        return state
+
+    @property
+    def nbytes(self):
+        return module_nbytes(self.module)
+
+    def dump(self):
+        '''
+        Everything but the module values, which SessionStore saves once per module version
+        '''
+        module = dump_module(self.module)
+        if module is not None:
+            module.pop('__normalized_values__', None)
+        return {
+            'compendium': dump_compendium(self.compendium),
+            'module': module,
+            'module_version': self.module_version,
+            'previous_module_version': self.previous_module_version,
+            'module_job': self.module_job,
+            'module_edit': self.module_edit.dump(),
+            'n_clicks': self.n_clicks,
+        }
+
+    @staticmethod
+    def load(session_id, data, connection=None, values=None):
+        state = SessionState(session_id)
+        state.compendium = load_compendium(data['compendium'], connection)
+        state.module = load_module(data['module'], connection)
+        if state.module is not None:
+            state.module.__normalized_values__ = values
+        state.module_version = data['module_version']
+        state.previous_module_version = data.get('previous_module_version')
+        state.module_job = data.get('module_job')
+        state.module_edit = ModuleEdit.load(data.get('module_edit'))
+        state.n_clicks = data['n_clicks']
+        return state
+
+
+class _SessionLock:
+    '''
+    Re-entrant lock of one session, held across threads with an RLock and across gunicorn
+    workers with an exclusive flock on lock_file, taken by the outermost acquire
+    '''
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        # copy being edited by the thread holding the lock
+        self.state = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                # keep it from being purged while the session is in use
+                os.utime(self._fd)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._rlock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def idle(self):
+        if not self._rlock.acquire(blocking=False):
+            return False
+        try:
+            return self._depth == 0
+        finally:
+            self._rlock.release()
+
+
+class SessionStore:
+    '''
+    Server-side store of SessionState objects keyed by session id.
+
+    States are written through to folder, which is shared by all gunicorn workers, and kept in
+    an in-memory LRU bounded by max_bytes. A state is reloaded from disk when another worker
+    saved a newer copy, and evicted states are simply read back on the next request. Module
+    values are saved once per module version next to the states and memory-mapped back, so
+    saving a state only writes the small rest. edit() locks the session file across workers.
+    on_save(state) is called after the saves that change the module version.
+    '''
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024, max_age=SESSION_MAX_AGE, connection=None, on_save=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.connection = connection
+        self.on_save = on_save
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._session_locks = {}
+        self._last_purge = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.folder, session_id + '.pkl')
+
+    def _values_path(self, module_version):
+        return os.path.join(self.folder, module_version + '.npy')
+
+    def _session_lock(self, session_id):
+        with self._lock:
+            if session_id not in self._session_locks:
+                self._session_locks[session_id] = _SessionLock(os.path.join(self.folder, session_id + '.lock'))
+            return self._session_locks[session_id]
+
+    @staticmethod
+    def _stamp(st):
+        # the inode changes with every os.replace, even within the mtime resolution
+        return st.st_mtime_ns, st.st_ino, st.st_size
+
+    def _read(self, session_id):
+        try:
+            with open(self._path(session_id), 'rb') as fi:
+                stamp = self._stamp(os.fstat(fi.fileno()))
+                data = pickle.load(fi)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None, None
+        values = None
+        if data['module'] is not None and data['module_version']:
+            try:
+                values = np.load(self._values_path(data['module_version']), mmap_mode='r')
+            except (OSError, ValueError):
+                # fetched again from COMPASS on first use
+                pass
+        return SessionState.load(session_id, data, self.connection, values), stamp
+
+    def _write_values(self, state):
+        values = state.module.__dict__.get('__normalized_values__') if state.module is not None else None
+        if values is None or len(values) == 0 or not state.module_version:
+            return
+        path = self._values_path(state.module_version)
+        if os.path.exists(path):
+            # still referenced, keep it from being purged
+            os.utime(path)
+            return
+        tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'wb') as fo:
+            np.save(fo, np.asarray(values), allow_pickle=False)
+        os.replace(tmp, path)
+
+    def _write(self, state):
+        self._write_values(state)
+        path = self._path(state.session_id)
+        tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'wb') as fo:
+            pickle.dump(state.dump(), fo, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return self._stamp(os.stat(path))
+
+    def _remember(self, state, stamp):
+        with self._lock:
+            old = self._entries.pop(state.session_id, None)
+            if old is not None:
+                self._nbytes -= old[2]
+            size = state.nbytes
+            self._entries[state.session_id] = (state, stamp, size)
+            self._nbytes += size
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_size
+
+    def get(self, session_id=None):
+        session_id = session_id or get_session_id()
+        try:
+            stamp = self._stamp(os.stat(self._path(session_id)))
+        except OSError:
+            stamp = None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[1] == stamp:
+                self._entries.move_to_end(session_id)
+                return entry[0]
+        if stamp is None:
+            state = SessionState(session_id)
+        else:
+            state, stamp = self._read(session_id)
+            if state is None:
+                state = SessionState(session_id)
+        self._remember(state, stamp)
+        return state
+
+    def save(self, state):
+        with self._lock:
+            entry = self._entries.get(state.session_id)
+        changed = entry is None or entry[0].module_version != state.module_version
+        stamp = self._write(state)
+        self._remember(state, stamp)
+        self.purge()
+        if self.on_save is not None and changed:
+            self.on_save(state)
+
+    @contextmanager
+    def edit(self, session_id=None):
+        '''
+        Serialise the writers of one session, in every worker, and save the state on exit. The
+        state is read again once the lock is held, so no update of another worker is lost.
+        Changes are made on a copy that replaces the cached state when saved, so readers always
+        see a consistent state.
+        '''
+        session_id = session_id or get_session_id()
+        lock = self._session_lock(session_id)
+        with lock:
+            # a nested edit in the same thread works on the copy of the outer one
+            outer = lock.state
+            if outer is None:
+                lock.state = self.get(session_id).copy()
+            try:
+                yield lock.state
+                self.save(lock.state)
+            finally:
+                if outer is None:
+                    lock.state = None
+
+    def purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        with self._lock:
+            for session_id in [k for k, lock in self._session_locks.items() if lock.idle()]:
+                del self._session_locks[session_id]
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
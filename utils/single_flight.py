@@ -0,0 +1,71 @@
+import copy
+import threading
+
+from utils.query_cache import query_key
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    '''
+    Coalesce identical concurrent calls: while the call for a key is in flight, other callers
+    with the same key wait for it and get a copy of its result (or its exception) instead of
+    making the call again. Nothing is remembered once the call returns.
+    '''
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.counters['calls'] += 1
+            else:
+                call.waiters += 1
+                leader = False
+                self.counters['coalesced'] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        if call.error is not None:
+            raise call.error
+        # the waiters are known now that the call is no longer registered
+        return copy.deepcopy(call.result) if call.waiters else call.result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+    def wrap(self, run_query):
+        '''
+        Return a run_query that shares the response of identical GraphQL queries in flight
+        '''
+        def single_flight_run_query(url, query, headers=None):
+            if query.lstrip().startswith('mutation'):
+                return run_query(url, query, headers)
+            return self.do(query_key(url, query), lambda: run_query(url, query, headers))
+        return single_flight_run_query
@@ -0,0 +1,171 @@
+import numpy as np
+
+from utils.lru import LRUCache
+
+SKETCH_CENTROIDS = 2000
+CHUNK_SIZE = 1 << 20
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch: at most max_centroids (mean, weight) pairs, spaced on an arcsine
+    scale so that the tails (1st, 95th percentile, ...) keep the finest resolution
+    '''
+
+    def __init__(self, means=None, weights=None, max_centroids=SKETCH_CENTROIDS):
+        self.max_centroids = max_centroids
+        self.means = np.zeros(0) if means is None else np.asarray(means, dtype=float)
+        self.weights = np.zeros(0) if weights is None else np.asarray(weights, dtype=float)
+        self._compress()
+
+    @staticmethod
+    def from_values(values, max_centroids=SKETCH_CENTROIDS):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        return QuantileSketch(values, np.ones(len(values)), max_centroids)
+
+    def _compress(self):
+        order = np.argsort(self.means, kind='stable')
+        self.means, self.weights = self.means[order], self.weights[order]
+        if len(self.means) <= self.max_centroids:
+            return
+        cumulative = np.cumsum(self.weights)
+        q = (cumulative - self.weights / 2) / cumulative[-1]
+        bucket = np.floor((np.arcsin(2 * q - 1) / np.pi + 0.5) * self.max_centroids)
+        bucket = np.clip(bucket, 0, self.max_centroids - 1).astype(int)
+        weights = np.bincount(bucket, self.weights, self.max_centroids)
+        sums = np.bincount(bucket, self.weights * self.means, self.max_centroids)
+        used = weights > 0
+        self.means = sums[used] / weights[used]
+        self.weights = weights[used]
+
+    def merge(self, other):
+        return QuantileSketch(np.concatenate([self.means, other.means]),
+                              np.concatenate([self.weights, other.weights]),
+                              max(self.max_centroids, other.max_centroids))
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def quantile(self, q, lower=None, upper=None):
+        '''
+        Approximate q quantile (0 <= q <= 1), interpolated between centroids and the exact
+        lower and upper bounds when given
+        '''
+        if not len(self.means):
+            return np.nan
+        positions = np.cumsum(self.weights) - self.weights / 2
+        means = self.means
+        if lower is not None:
+            positions = np.concatenate([[0.0], positions])
+            means = np.concatenate([[lower], means])
+        if upper is not None:
+            positions = np.concatenate([positions, [self.count]])
+            means = np.concatenate([means, [upper]])
+        return float(np.interp(q * self.count, positions, means))
+
+
+class ModuleStats:
+    '''
+    NaN-aware summary of a module values matrix: count, missing values, min, max, mean and a
+    quantile sketch, built in chunks and mergeable with the summary of other rows or columns
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.nan_count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.total = 0.0
+        self.sketch = QuantileSketch()
+        self.row_ids = ()
+        self.column_ids = ()
+
+    @staticmethod
+    def from_values(values, row_ids=(), column_ids=()):
+        stats = ModuleStats()
+        flat = np.asarray(values, dtype=float).ravel()
+        for start in range(0, len(flat), CHUNK_SIZE):
+            stats._update(flat[start:start + CHUNK_SIZE])
+        stats.row_ids = tuple(row_ids)
+        stats.column_ids = tuple(column_ids)
+        return stats
+
+    @staticmethod
+    def from_module(module):
+        return ModuleStats.from_values(module.values,
+                                       [bf.id for bf in module.biological_features],
+                                       [ss.id for ss in module.sample_sets])
+
+    def _update(self, chunk):
+        finite = chunk[~np.isnan(chunk)]
+        self.nan_count += len(chunk) - len(finite)
+        if not len(finite):
+            return
+        self.count += len(finite)
+        self.min = min(self.min, finite.min())
+        self.max = max(self.max, finite.max())
+        self.total += finite.sum()
+        self.sketch = self.sketch.merge(QuantileSketch.from_values(finite))
+
+    def merge(self, other, row_ids=(), column_ids=()):
+        stats = ModuleStats()
+        stats.count = self.count + other.count
+        stats.nan_count = self.nan_count + other.nan_count
+        stats.min = min(self.min, other.min)
+        stats.max = max(self.max, other.max)
+        stats.total = self.total + other.total
+        stats.sketch = self.sketch.merge(other.sketch)
+        stats.row_ids = tuple(row_ids)
+        stats.column_ids = tuple(column_ids)
+        return stats
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def percentile(self, p):
+        if not self.count:
+            return np.nan
+        return self.sketch.quantile(p / 100.0, self.min, self.max)
+
+    def histogram(self, bins=50):
+        if not self.count:
+            return np.zeros(bins), np.linspace(0, 1, bins + 1)
+        return np.histogram(self.sketch.means, bins=bins, range=(self.min, self.max), weights=self.sketch.weights)
+
+    def updated(self, module):
+        '''
+        Statistics of module, a later version of the module summarised here. When rows or columns
+        were only added, the summary of the new cells is merged in; otherwise values are rescanned.
+        '''
+        row_ids = [bf.id for bf in module.biological_features]
+        column_ids = [ss.id for ss in module.sample_sets]
+        old_rows, old_columns = set(self.row_ids), set(self.column_ids)
+        new_rows = [i for i, x in enumerate(row_ids) if x not in old_rows]
+        new_columns = [i for i, x in enumerate(column_ids) if x not in old_columns]
+        values = module.values
+        if set(column_ids) == old_columns and len(row_ids) == len(old_rows) + len(new_rows):
+            return self.merge(ModuleStats.from_values(values[new_rows, :]), row_ids, column_ids)
+        if set(row_ids) == old_rows and len(column_ids) == len(old_columns) + len(new_columns):
+            return self.merge(ModuleStats.from_values(values[:, new_columns]), row_ids, column_ids)
+        return ModuleStats.from_values(values, row_ids, column_ids)
+
+
+class StatsCache:
+    '''
+    ModuleStats keyed by module version. The statistics of a new version are derived from those
+    of the version it was edited from, when still cached.
+    '''
+
+    def __init__(self, max_entries=64):
+        self._stats = LRUCache(max_entries=max_entries)
+
+    def get(self, module_version, module, previous_version=None):
+        def build():
+            previous = self._stats.get(previous_version) if previous_version else None
+            if previous is not None:
+                return previous.updated(module)
+            return ModuleStats.from_module(module)
+        return self._stats.get_or_create(module_version, build)
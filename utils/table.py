@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.filters import compile_filter
+from utils.lru import LRUCache
+
+TABLE_FIELDS = {
+    'biological_features': ('id', 'name', 'description'),
+    'sample_sets': ('id', 'name'),
+}
+
+
+class ModuleTable:
+    '''
+    The rows of one DataTable tab (biological features or sample sets) of one module version,
+    built once, with the row order of every (filter_query, sort_by) seen so far
+    '''
+
+    def __init__(self, objects, fields, max_views=256):
+        self.columns = [x for x in objects[0].__dict__.keys() if x in fields] if objects else []
+        self.frame = pd.DataFrame([x.__dict__ for x in objects], columns=self.columns)
+        self.max_views = max_views
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def rows(self, filter_query, sort_by):
+        '''
+        Positions of the filtered and sorted rows
+        '''
+        sort_key = tuple((col['column_id'], col['direction']) for col in sort_by or [])
+        key = (filter_query or '', sort_key)
+        with self._lock:
+            rows = self._views.get(key)
+            if rows is not None:
+                self._views.move_to_end(key)
+                return rows
+        dff = self.frame.iloc[compile_filter(filter_query or '').rows(self.frame)]
+        if len(sort_key):
+            dff = dff.sort_values(
+                [c for c, _ in sort_key],
+                ascending=[d == 'asc' for _, d in sort_key],
+                inplace=False
+            )
+        rows = np.asarray(dff.index, dtype=np.intp)
+        with self._lock:
+            self._views[key] = rows
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return rows
+
+    def page(self, page_current, page_size, sort_by, filter_query):
+        rows = self.rows(filter_query, sort_by)
+        return self.frame.iloc[rows[page_current * page_size: (page_current + 1) * page_size]].to_dict('records')
+
+
+class TableCache:
+    '''
+    ModuleTable objects keyed by (module version, tab). A module change gets a new version,
+    so the tables of the previous one are never looked up again and age out of the LRU.
+    '''
+
+    def __init__(self, max_tables=64):
+        self._tables = LRUCache(max_entries=max_tables)
+
+    def get(self, module_version, kind, module):
+        return self._tables.get_or_create((module_version, kind),
+                                          lambda: ModuleTable(getattr(module, kind), TABLE_FIELDS[kind]))
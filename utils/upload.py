@@ -0,0 +1,120 @@
+import csv
+import os
+import re
+import time
+import zipfile
+import zlib
+
+import requests
+
+from utils.export import InvalidModuleFile, read_npz, read_tsv
+
+# bytes sent by the browser in each request
+CHUNK_BYTES = 4 * 1024 * 1024
+WRITE_BLOCK = 1 << 16
+UPLOAD_MAX_AGE = 24 * 3600
+UPLOAD_MAX_BYTES = 1024 * 1024 * 1024
+
+_upload_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class UploadStore:
+    '''
+    Module files uploaded in chunks: every chunk is appended to a part file in folder at the
+    offset the browser says it starts from, so memory use does not depend on the file size and
+    an interrupted upload can resume from the size reported back. Only npz and TSV files of up
+    to max_bytes are accepted.
+    '''
+
+    def __init__(self, folder, max_age=UPLOAD_MAX_AGE, max_bytes=UPLOAD_MAX_BYTES):
+        self.folder = folder
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._last_purge = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, session_id, upload_id):
+        if not _upload_id_re.match(upload_id):
+            raise UploadError('Invalid upload id')
+        return os.path.join(self.folder, session_id + '-' + upload_id + '.part')
+
+    def size(self, session_id, upload_id):
+        try:
+            return os.path.getsize(self._path(session_id, upload_id))
+        except (OSError, UploadError):
+            return 0
+
+    def append(self, session_id, upload_id, offset, stream):
+        '''
+        Write the chunk read from stream at offset and return the new size of the upload
+        '''
+        path = self._path(session_id, upload_id)
+        if offset == 0:
+            self.purge()
+        if offset != self.size(session_id, upload_id):
+            raise UploadError('Unexpected offset')
+        with open(path, 'ab') as fo:
+            for block in iter(lambda: stream.read(WRITE_BLOCK), b''):
+                offset += len(block)
+                if offset > self.max_bytes:
+                    break
+                fo.write(block)
+        if offset > self.max_bytes:
+            os.remove(path)
+            raise UploadTooLarge('The file is larger than {mb} MB'.format(mb=self.max_bytes // (1024 * 1024)))
+        return self.size(session_id, upload_id)
+
+    def finish(self, session_id, upload_id, filename, compendium):
+        '''
+        Module parsed from the completed upload and bound to compendium, whose part file is then
+        removed
+        '''
+        path = self._path(session_id, upload_id)
+        if not os.path.exists(path):
+            raise UploadError('Unknown upload')
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                raise UploadTooLarge('The file is larger than {mb} MB'.format(mb=self.max_bytes // (1024 * 1024)))
+            if not filename.endswith(('.npz', '.tsv', '.tsv.gz')):
+                # Module.read_from_file unpickles the file: never for files coming from users
+                raise UploadError('Only npz and TSV module files can be uploaded')
+            if compendium is None:
+                raise UploadError('Select a compendium first')
+            if not filename.endswith('.npz'):
+                named = path + ('.tsv.gz' if filename.endswith('.gz') else '.tsv')
+                os.replace(path, named)
+                path = named
+            try:
+                # npz values stay memory-mapped until the session is saved
+                return read_npz(path, compendium) if filename.endswith('.npz') else read_tsv(path, compendium)
+            except InvalidModuleFile as e:
+                raise UploadError(str(e))
+            except requests.RequestException:
+                # COMPASS unreachable, not a bad file
+                raise
+            except (ValueError, KeyError, IndexError, StopIteration, EOFError, OSError, csv.Error, zlib.error,
+                    zipfile.BadZipFile):
+                raise UploadError('Invalid module file')
+        finally:
+            os.remove(path)
+
+    def purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                if now - os.stat(path).st_mtime > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
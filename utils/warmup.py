@@ -0,0 +1,52 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.lru import LRUCache
+from utils.module_io import snapshot_module
+
+logger = logging.getLogger(__name__)
+
+
+class ModuleWarmup:
+    '''
+    Build what every tab shows as soon as a new module version is saved, on a pool of threads,
+    so that the tabs find it in their caches. Tasks are registered per tab as
+    fn(module_version, module, previous_module_version) and queued most visited tab first. They
+    get a snapshot of the module, never the object of the session.
+    '''
+
+    def __init__(self, max_workers=4, max_versions=256):
+        self.tasks = {}
+        self.visits = Counter()
+        self._started = LRUCache(max_entries=max_versions)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def register(self, tab, fn):
+        self.tasks[tab] = fn
+
+    def visit(self, tab):
+        self.visits[tab] += 1
+
+    def order(self):
+        # ties keep the registration order
+        return sorted(self.tasks, key=lambda tab: -self.visits[tab])
+
+    def start(self, module_version, module, previous_module_version=None):
+        if module is None or module_version is None:
+            return
+        with self._lock:
+            if module_version in self._started:
+                return
+            self._started.put(module_version, True)
+        module = snapshot_module(module)
+        for tab in self.order():
+            self._executor.submit(self._run, tab, module_version, module, previous_module_version)
+
+    def _run(self, tab, module_version, module, previous_module_version):
+        try:
+            self.tasks[tab](module_version, module, previous_module_version)
+        except Exception:
+            logger.exception('Unable to warm up the %s tab of module %s', tab, module_version)